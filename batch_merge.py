@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batch merging of a whole subtitle library.
+
+Subtitle files named <name>.<lang>.<ext> (srt, smi, vtt, ass or ssa) are
+paired by <name> (inside the same directory) and every pair holding both
+requested languages is merged into <name>.<top_lang>-<bottom_lang>.srt.
+Pairs are merged by a pool of worker processes, so the interpreter and its
+imports are only loaded once per worker instead of once per file.
+"""
+from __future__ import print_function
+import io
+import json
+import os
+import re
+import sys
+import time
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sub_merger import Merger
+
+# <name>.<lang>.<ext>; a custom pattern needs the name, lang and ext groups
+NAME_PATTERN = (r'^(?P<name>.+)\.(?P<lang>[^.]+)\.'
+                r'(?P<ext>srt|smi|vtt|ass|ssa)$')
+
+
+def discover_pairs(root, top_lang, bottom_lang, pattern=NAME_PATTERN,
+                   output_dir=None, recursive=True):
+    ''' list of (top, bottom, output) paths found under root '''
+    regex = re.compile(pattern, re.IGNORECASE)
+    top_lang = top_lang.lower()
+    bottom_lang = bottom_lang.lower()
+    pairs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if not recursive:
+            del dirnames[:]
+        found = dict()
+        for filename in sorted(filenames):
+            m = regex.match(filename)
+            if m is None:
+                continue
+            lang = m.group('lang').lower()
+            if lang in (top_lang, bottom_lang):
+                # .srt wins over the other formats when a language has
+                # several
+                key = (m.group('name'), lang)
+                if key not in found or m.group('ext').lower() == 'srt':
+                    found[key] = os.path.join(dirpath, filename)
+        names = sorted(set(name for name, lang in found))
+        for name in names:
+            top = found.get((name, top_lang))
+            bottom = found.get((name, bottom_lang))
+            if top is None or bottom is None:
+                continue
+            output = os.path.join(output_dir or dirpath, '%s.%s-%s.srt'
+                                  % (name, top_lang, bottom_lang))
+            pairs.append((top, bottom, output))
+    return pairs
+
+
+def merge_pair(top, bottom, output, output_encoding='utf-8',
+               encoding_cache=None, track_cache=None):
+    ''' merge one pair; returns a result dict, never raises '''
+    started = time.time()
+    result = {'top': top, 'bottom': bottom, 'output': output}
+    # Merger reports problems on stdout; keep them for the result instead
+    messages = io.StringIO()
+    try:
+        with redirect_stdout(messages):
+            m = Merger(output_file=output, output_encoding=output_encoding,
+                       encoding_cache=encoding_cache,
+                       track_cache=track_cache)
+            m.add(top, bottom)
+            with io.open(output, 'wb') as stream:
+                m._write(stream)
+        result['ok'] = True
+        result['cues'] = len(m.subtitles)
+    except (Exception, SystemExit) as e:
+        # Merger exits on invalid timecodes; report it as a failure
+        result['ok'] = False
+        result['error'] = ' '.join(messages.getvalue().split()) or \
+            '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.time() - started
+    return result
+
+
+def merge_batch(pairs, workers=None, output_encoding='utf-8',
+                encoding_cache=None, report=None, track_cache=None):
+    ''' merge every (top, bottom, output) pair across a process pool.
+
+    workers defaults to the number of cores. report, if given, is called
+    with each result as soon as its pair is done. track_cache is the
+    directory of the parsed track cache, if any. Returns the results (in
+    the order of pairs) and a summary dict.
+    '''
+    started = time.time()
+    results = [None] * len(pairs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = dict()
+        for i, (top, bottom, output) in enumerate(pairs):
+            future = executor.submit(merge_pair, top, bottom, output,
+                                     output_encoding, encoding_cache,
+                                     track_cache)
+            futures[future] = i
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if report is not None:
+                report(result)
+
+    wall = time.time() - started
+    merged = [r for r in results if r['ok']]
+    cues = sum(r['cues'] for r in merged)
+    summary = {
+        'pairs': len(results),
+        'merged': len(merged),
+        'failed': len(results) - len(merged),
+        'cues': cues,
+        'wall_seconds': wall,
+        'worker_seconds': sum(r['seconds'] for r in results),
+        'pairs_per_second': len(results) / wall if wall > 0 else 0.0,
+        'cues_per_second': cues / wall if wall > 0 else 0.0,
+        }
+    return results, summary
+
+
+def _print_result(result):
+    if result['ok']:
+        print('OK   %s (%d cues, %.3fs)' % (result['output'], result['cues'],
+                                           result['seconds']))
+    else:
+        print('FAIL %s + %s: %s' % (result['top'], result['bottom'],
+                                    result['error']))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    import argparse
+    from track_cache import TrackCache, default_directory
+    parser = argparse.ArgumentParser(
+        description='Merge every <name>.<top>.srt/.smi/.vtt/.ass with its '
+                    '<name>.<bottom>.srt/.smi/.vtt/.ass found under a '
+                    'directory.')
+    parser.add_argument('root', help='directory to search')
+    parser.add_argument('top_lang', help='language shown on top, e.g. ko')
+    parser.add_argument('bottom_lang',
+                        help='language shown on bottom, e.g. en')
+    parser.add_argument('-e', '--encoding', default='utf-8',
+                        help='encoding of the merged files (default: utf-8)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: number of cores)')
+    parser.add_argument('--pattern', default=NAME_PATTERN,
+                        help='regex with name, lang and ext groups matching '
+                             'subtitle file names')
+    parser.add_argument('--output-dir',
+                        help='write merged files here instead of next to '
+                             'their sources')
+    parser.add_argument('--no-recursive', action='store_true',
+                        help='do not search sub directories')
+    parser.add_argument('--encoding-cache', metavar='FILE',
+                        help='JSON file remembering the detected encoding '
+                             'of input files between runs')
+    parser.add_argument('--report', metavar='FILE',
+                        help='write the per-file results and summary as JSON')
+    parser.add_argument('--cache-dir', default=default_directory(),
+                        help='directory of the parsed track cache, with '
+                             '--cache (default: %(default)s)')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep parsed inputs in the parsed track cache '
+                             'and read them back from it on later runs')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='empty the parsed track cache first')
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        TrackCache(args.cache_dir).clear()
+    track_cache = args.cache_dir if args.cache else None
+
+    pairs = discover_pairs(args.root, args.top_lang, args.bottom_lang,
+                           args.pattern, args.output_dir,
+                           not args.no_recursive)
+    if not pairs:
+        print('No %s/%s subtitle pairs found under %s'
+              % (args.top_lang, args.bottom_lang, args.root))
+        sys.exit(1)
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    results, summary = merge_batch(pairs, args.jobs, args.encoding,
+                                   args.encoding_cache, _print_result,
+                                   track_cache)
+    print('%d/%d pairs merged, %d failed, %d cues in %.2fs '
+          '(%.1f pairs/s, %.0f cues/s)'
+          % (summary['merged'], summary['pairs'], summary['failed'],
+             summary['cues'], summary['wall_seconds'],
+             summary['pairs_per_second'], summary['cues_per_second']))
+    if args.report:
+        with io.open(args.report, 'w', encoding='utf-8') as report:
+            json.dump({'summary': summary, 'results': results}, report,
+                      indent=2)
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bulk conversion of SAMI (.smi) files to SRT.
+
+Usage:
+$python batch_smi2srt.py archive/ [-e utf-8] [-j 8] [--output-dir out/]
+
+Every .smi file found under the given directories is converted to a .srt
+file next to it (or at the same relative place under --output-dir) by a
+pool of worker processes. Files whose output is up to date are skipped:
+with --check mtime (the default) when the output is newer than its source,
+with --check hash when the content hash of the source is the one recorded
+by the previous run and the output has not changed since. The result of
+every file and a summary are written to a JSON manifest, which --check
+hash reads back on the next run.
+
+Only the cue table of every file is built; the SRT line list and the
+analysis_srt structure are only computed with --analysis.
+"""
+from __future__ import print_function
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from encoding_detect import file_digest
+from smi2srt import SMI2SRT, logger
+
+MANIFEST_NAME = 'smi2srt-manifest.json'
+
+
+def discover_smi(roots, output_dir=None, recursive=True):
+    ''' list of (smi, srt) paths of the .smi files under roots '''
+    jobs = []
+    for root in roots:
+        if os.path.isfile(root):
+            walk = [(os.path.dirname(root), [], [os.path.basename(root)])]
+            root = os.path.dirname(root)
+        else:
+            walk = os.walk(root)
+        for dirpath, dirnames, filenames in walk:
+            dirnames.sort()
+            if not recursive:
+                del dirnames[:]
+            for filename in sorted(filenames):
+                name, extension = os.path.splitext(filename)
+                if extension.lower() != '.smi':
+                    continue
+                target = dirpath
+                if output_dir is not None:
+                    target = os.path.normpath(os.path.join(
+                        output_dir, os.path.relpath(dirpath, root)))
+                jobs.append((os.path.join(dirpath, filename),
+                             os.path.join(target, name + '.srt')))
+    return jobs
+
+
+def _up_to_date(smi, srt, encoding, check, previous):
+    # (True when srt needs no conversion, content hash of smi or None)
+    digest = None
+    if not os.path.exists(srt):
+        return False, digest
+    if previous is not None and (not previous.get('ok') or
+                                 previous.get('encoding') != encoding):
+        return False, digest
+    if check == 'mtime':
+        return os.stat(srt).st_mtime_ns >= os.stat(smi).st_mtime_ns, digest
+    with io.open(smi, 'rb') as file:
+        digest = file_digest(file)
+    if previous is None or previous.get('source_hash') != digest:
+        return False, digest
+    stat = os.stat(srt)
+    return (stat.st_size == previous.get('output_size') and
+            stat.st_mtime_ns == previous.get('output_mtime_ns')), digest
+
+
+class _Messages(logging.Handler):
+    # keeps the errors smi2srt logs while converting a file
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage().strip())
+
+
+def convert_file(smi, srt, encoding='utf-8', check='mtime', previous=None,
+                 encoding_cache=None, analysis=False, force=False):
+    ''' convert one file unless it is up to date; returns a result dict,
+    never raises.
+
+    previous is the manifest entry of the file from the last run, if any.
+    '''
+    started = time.time()
+    result = {'smi': smi, 'output': srt, 'encoding': encoding}
+    messages = _Messages()
+    logger.addHandler(messages)
+    temp = '%s.%d.tmp' % (srt, os.getpid())
+    try:
+        skip, digest = (False, None) if force else \
+            _up_to_date(smi, srt, encoding, check, previous)
+        if skip:
+            # what the manifest knows of the output, if anything
+            result = dict(previous or {}, **result)
+            result.update({'ok': True, 'skipped': True})
+        else:
+            if os.path.dirname(srt):
+                os.makedirs(os.path.dirname(srt), exist_ok=True)
+            obj = SMI2SRT(smi=smi, encoding=encoding,
+                          encoding_cache=encoding_cache)
+            if obj.convert_smi(temp) is False:
+                raise ValueError('cannot be converted')
+            # written aside and moved in place, so an interrupted run never
+            # leaves a partial output looking up to date
+            obj._print_srt()
+            os.replace(temp, srt)
+            if digest is None:
+                with io.open(smi, 'rb') as file:
+                    digest = file_digest(file)
+            stat = os.stat(srt)
+            result.update({'ok': True, 'skipped': False,
+                           'cues': len(obj.mySubs), 'source_hash': digest,
+                           'output_size': stat.st_size,
+                           'output_mtime_ns': stat.st_mtime_ns})
+            if analysis:
+                result['subtitles'] = len(obj.analysis_srt())
+    except Exception as e:
+        result['ok'] = False
+        result['skipped'] = False
+        result['error'] = '; '.join(messages.messages) or \
+            '%s: %s' % (type(e).__name__, e)
+        if os.path.exists(temp):
+            os.remove(temp)
+    finally:
+        logger.removeHandler(messages)
+    result['seconds'] = time.time() - started
+    return result
+
+
+def load_manifest(path):
+    ''' {smi path: result} of a manifest written by a previous run '''
+    try:
+        with io.open(path, 'r', encoding='utf-8') as file:
+            return json.load(file).get('files', {})
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, results, summary):
+    data = {'summary': summary,
+            'files': dict((result['smi'], result) for result in results)}
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    with io.open(temp, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=1, sort_keys=True)
+    os.replace(temp, path)
+
+
+def convert_batch(jobs, workers=None, encoding='utf-8', check='mtime',
+                  manifest=None, encoding_cache=None, analysis=False,
+                  force=False, report=None):
+    ''' convert every (smi, srt) job across a process pool.
+
+    manifest is the {smi path: result} of the previous run. report, if
+    given, is called with each result as soon as its file is done. Returns
+    the results (in the order of jobs) and a summary dict.
+    '''
+    manifest = manifest or {}
+    started = time.time()
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = dict()
+        for i, (smi, srt) in enumerate(jobs):
+            future = executor.submit(convert_file, smi, srt, encoding, check,
+                                     manifest.get(smi), encoding_cache,
+                                     analysis, force)
+            futures[future] = i
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if report is not None:
+                report(result)
+
+    wall = time.time() - started
+    converted = [r for r in results if r['ok'] and not r['skipped']]
+    cues = sum(r['cues'] for r in converted)
+    summary = {
+        'files': len(results),
+        'converted': len(converted),
+        'skipped': sum(1 for r in results if r['skipped']),
+        'failed': sum(1 for r in results if not r['ok']),
+        'cues': cues,
+        'wall_seconds': wall,
+        'worker_seconds': sum(r['seconds'] for r in results),
+        'files_per_second': len(converted) / wall if wall > 0 else 0.0,
+        'cues_per_second': cues / wall if wall > 0 else 0.0,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+    return results, summary
+
+
+def _print_result(result):
+    if not result['ok']:
+        print('FAIL %s: %s' % (result['smi'], result['error']))
+    elif not result['skipped']:
+        print('OK   %s (%d cues, %.3fs)' % (result['output'], result['cues'],
+                                           result['seconds']))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert every .smi file under directories to SRT.')
+    parser.add_argument('roots', nargs='+',
+                        help='directories (or .smi files) to convert')
+    parser.add_argument('-e', '--encoding', default='utf-8',
+                        help='encoding of the SRT files (default: utf-8)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: number of cores)')
+    parser.add_argument('--output-dir',
+                        help='write SRT files here, in the same sub '
+                             'directories, instead of next to their sources')
+    parser.add_argument('--no-recursive', action='store_true',
+                        help='do not search sub directories')
+    parser.add_argument('--check', choices=('mtime', 'hash'),
+                        default='mtime',
+                        help='how outputs are found up to date: newer than '
+                             'their source, or source hash unchanged since '
+                             'the manifest (default: %(default)s)')
+    parser.add_argument('--force', action='store_true',
+                        help='convert every file, even up to date ones')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='JSON manifest of the results (default: %s in '
+                             'the output directory, or the first root)'
+                             % MANIFEST_NAME)
+    parser.add_argument('--encoding-cache', metavar='FILE',
+                        help='JSON file remembering the detected encoding '
+                             'of input files between runs')
+    parser.add_argument('--analysis', action='store_true',
+                        help='also build the SRT lines and analysis_srt '
+                             'structure of every file, and count its '
+                             'subtitles')
+    args = parser.parse_args()
+
+    jobs = discover_smi(args.roots, args.output_dir, not args.no_recursive)
+    if not jobs:
+        print('No .smi files found under %s' % ', '.join(args.roots))
+        sys.exit(1)
+    manifest_path = args.manifest
+    if manifest_path is None:
+        base = args.output_dir or args.roots[0]
+        if os.path.isfile(base):
+            base = os.path.dirname(base)
+        manifest_path = os.path.join(base, MANIFEST_NAME)
+    if os.path.dirname(manifest_path):
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+
+    results, summary = convert_batch(
+        jobs, args.jobs, args.encoding, args.check,
+        load_manifest(manifest_path), args.encoding_cache, args.analysis,
+        args.force, _print_result)
+    save_manifest(manifest_path, results, summary)
+    print('%d/%d files converted, %d up to date, %d failed, %d cues in '
+          '%.2fs (%.1f files/s, %.0f cues/s)'
+          % (summary['converted'], summary['files'], summary['skipped'],
+             summary['failed'], summary['cues'], summary['wall_seconds'],
+             summary['files_per_second'], summary['cues_per_second']))
+    sys.exit(1 if summary['failed'] else 0)
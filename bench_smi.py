@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the single-pass SMI tokenizer against the line by line one.
+
+Usage:
+$python bench_smi.py [file.smi ...]
+
+Without files, a synthetic SAMI document of --syncs SYNC blocks is used
+and treated as a CP949 file.
+
+Both tokenizers run on the same decoded document and the cues they give,
+once cleaned by smiItem.srt_texts, are compared.
+"""
+from __future__ import print_function
+import io
+import random
+import time
+
+from smi2srt import SMI2SRT, smiItem
+from encoding_detect import detect_encoding
+
+
+def synthetic_smi(syncs, seed=0):
+    ''' decoded SAMI document of syncs SYNC blocks '''
+    rnd = random.Random(seed)
+    parts = ['<SAMI>\r\n<HEAD>\r\n<TITLE>bench</TITLE>\r\n</HEAD>\r\n'
+             '<BODY>\r\n']
+    time_ms = 1000
+    for i in range(syncs):
+        parts.append('<SYNC Start=%d><P Class=KRCC>\r\n' % time_ms)
+        if rnd.random() < 0.3:
+            parts.append('&nbsp;\r\n')
+        else:
+            parts.append('<font color="#ffffff">line %d</font><br>\r\n'
+                         '  <b>second</b> line %d\r\n' % (i, i))
+        time_ms += rnd.randint(300, 4000)
+    parts.append('<SYNC Start=%d><P Class=KRCC>&nbsp;\r\n' % time_ms)
+    parts.append('</BODY>\r\n</SAMI>\r\n')
+    return ''.join(parts)
+
+
+def _cleaned(rows):
+    texts = smiItem.srt_texts([contents for start, end, contents in rows])
+    return [(row[0], row[1], text) for row, text in zip(rows, texts) if text]
+
+
+def bench(name, document, repeat, encoding):
+    timings = dict()
+    results = dict()
+    tokenizers = (('lines', lambda doc: SMI2SRT._tokenize_lines(doc, 0,
+                                                                encoding)),
+                  ('single-pass', SMI2SRT._tokenize))
+    for label, tokenize in tokenizers:
+        best = None
+        for _ in range(repeat):
+            started = time.time()
+            rows = list(tokenize(document))
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+        results[label] = _cleaned(rows)
+    same = results['lines'] == results['single-pass']
+    print('%s: %d chars, %d cues' % (name, len(document),
+                                     len(results['single-pass'])))
+    for label in ('lines', 'single-pass'):
+        print('  %-12s %.4fs' % (label, timings[label]))
+    print('  speed-up     %.1fx, same cues: %s'
+          % (timings['lines'] / timings['single-pass'], same))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('files', nargs='*', help='SAMI files to tokenize')
+    parser.add_argument('--syncs', type=int, default=200000,
+                        help='SYNC blocks of the synthetic document')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per tokenizer, the best one is kept')
+    args = parser.parse_args()
+
+    if not args.files:
+        bench('synthetic', synthetic_smi(args.syncs), args.repeat, 'cp949')
+    for path in args.files:
+        codec = detect_encoding(path, fallback=False)['encoding'] or 'utf-8'
+        with io.open(path, 'r', encoding=codec, newline='') as smi:
+            bench(path, smi.read(), args.repeat, codec)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the parsing, SMI conversion, merging and writing paths.
+
+Usage:
+$python benchmark.py [--cues 20000] [--repeat 3] [-o results.json]
+$python benchmark.py --compare before.json after.json
+
+Synthetic SRT and SAMI tracks are generated with a controllable number of
+cues, overlap density, cue length, tag density and encoding. Every stage
+is timed on its own (best of --repeat runs) and measured once more under
+tracemalloc for its peak memory:
+
+parse        Merger._read_track of both SRT tracks (detection included)
+convert_smi  SMI2SRT.convert_smi of the SAMI track
+add          Merger.add of both SRT tracks (reading and merging)
+add_smi      Merger.add of the top SRT track with the SAMI track
+write        Merger._write of the merged subtitles
+
+Results, with the git commit they were measured on, are saved as JSON;
+--compare prints the speed ratio of every stage between two of them.
+"""
+from __future__ import print_function
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from smi2srt import SMI2SRT
+from sub_merger import Merger
+from timecodes import ms_to_timestamp
+
+WORDS = {
+    'top': [u'안녕하세요', u'고마워요', u'어디', u'가요', u'정말', u'그래',
+            u'내일', u'봐요', u'사랑해', u'괜찮아', u'무슨', u'일이야'],
+    'bottom': ['hello', 'thank', 'you', 'where', 'are', 'going', 'really',
+               'tomorrow', 'see', 'love', 'fine', 'what', 'happened'],
+    }
+SRT_TAGS = [('<i>', '</i>'), ('<b>', '</b>'), ('<u>', '</u>')]
+SMI_TAGS = [('<font color="#ffff00">', '</font>'), ('<i>', '</i>'),
+            ('<b>', '</b>')]
+
+
+def synthetic_cues(cues, overlap=0.1, cue_ms=2500, tag_density=0.2,
+                   language='top', seed=0):
+    ''' list of (start, end, lines, tags) of a synthetic track.
+
+    overlap: share of cues starting before the previous one ends
+    cue_ms: average cue length
+    tag_density: share of cues with a formatting tag
+    '''
+    rnd = random.Random(seed)
+    words = WORDS[language]
+    rows = []
+    time_ms = 1000
+    previous_end = time_ms
+    for i in range(cues):
+        if rnd.random() < overlap:
+            start = rnd.randint(max(time_ms, previous_end - cue_ms),
+                                previous_end)
+        else:
+            start = previous_end + rnd.randint(50, cue_ms)
+        end = start + rnd.randint(cue_ms // 2, cue_ms * 3 // 2)
+        lines = [' '.join(rnd.choice(words) for _ in range(rnd.randint(2, 7)))
+                 for _ in range(rnd.randint(1, 2))]
+        rows.append((start, end, lines, rnd.random() < tag_density))
+        time_ms = start
+        previous_end = max(previous_end, end)
+    return rows
+
+
+def srt_document(rows, seed=0):
+    ''' SRT text of synthetic_cues rows '''
+    rnd = random.Random(seed)
+    parts = []
+    for i, (start, end, lines, tagged) in enumerate(rows):
+        if tagged:
+            begin, close = rnd.choice(SRT_TAGS)
+            lines = [begin + lines[0] + close] + lines[1:]
+        parts.append('%d\r\n%s --> %s\r\n%s\r\n' % (
+            i + 1, ms_to_timestamp(start), ms_to_timestamp(end),
+            '\r\n'.join(lines)))
+    return '\r\n'.join(parts)
+
+
+def smi_document(rows, seed=0):
+    ''' SAMI text of synthetic_cues rows; overlapping cues are cut at the
+    start of the next one as SAMI cannot overlap '''
+    rnd = random.Random(seed)
+    parts = ['<SAMI>\r\n<HEAD>\r\n<TITLE>benchmark</TITLE>\r\n'
+             '<STYLE TYPE="text/css">\r\n<!--\r\n'
+             'P { margin-left:8pt; }\r\n.KRCC { Name:Korean; lang:ko-KR; }\r\n'
+             '-->\r\n</STYLE>\r\n</HEAD>\r\n<BODY>\r\n']
+    for i, (start, end, lines, tagged) in enumerate(rows):
+        if tagged:
+            begin, close = rnd.choice(SMI_TAGS)
+            lines = [begin + lines[0] + close] + lines[1:]
+        parts.append('<SYNC Start=%d><P Class=KRCC>\r\n%s\r\n'
+                     % (start, '<br>'.join(lines)))
+        next_start = rows[i + 1][0] if i + 1 < len(rows) else end
+        if end < next_start:
+            parts.append('<SYNC Start=%d><P Class=KRCC>&nbsp;\r\n' % end)
+    parts.append('</BODY>\r\n</SAMI>\r\n')
+    return ''.join(parts)
+
+
+def write_tracks(directory, cues, overlap, cue_ms, tag_density, encoding,
+                 seed=0):
+    ''' paths of the top.srt, bottom.srt and top.smi tracks written to
+    directory '''
+    top = synthetic_cues(cues, overlap, cue_ms, tag_density, 'top', seed)
+    bottom = synthetic_cues(cues, overlap, cue_ms, tag_density, 'bottom',
+                            seed + 1)
+    documents = (('top.srt', srt_document(top, seed)),
+                 ('bottom.srt', srt_document(bottom, seed)),
+                 ('top.smi', smi_document(top, seed)))
+    paths = []
+    for name, document in documents:
+        path = os.path.join(directory, name)
+        with io.open(path, 'wb') as file:
+            file.write(document.encode(encoding))
+        paths.append(path)
+    return paths
+
+
+def git_commit():
+    ''' HEAD commit of the repository, or None '''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+            ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(run, repeat):
+    # (best seconds, peak bytes, result) of run()
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def _silenced(run):
+    # Merger prints progress on stdout
+    def silent():
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            return run()
+        finally:
+            sys.stdout = stdout
+    return silent
+
+
+def run_benchmarks(cues=20000, overlap=0.1, cue_ms=2500, tag_density=0.2,
+                   encoding='utf-8', repeat=3, legacy_merge=False, seed=0):
+    ''' dict of the measures of every stage '''
+    directory = tempfile.mkdtemp(prefix='bench-')
+    try:
+        top, bottom, smi = write_tracks(directory, cues, overlap, cue_ms,
+                                        tag_density, encoding, seed)
+        output = os.path.join(directory, 'merged.srt')
+        srt_bytes = os.path.getsize(top) + os.path.getsize(bottom)
+        smi_bytes = os.path.getsize(smi)
+
+        def merger():
+            return Merger(output_file=output, legacy_merge=legacy_merge)
+
+        def parse():
+            m = merger()
+            return len(m._read_track(top)) + len(m._read_track(bottom))
+
+        def convert_smi():
+            return len(SMI2SRT(smi, 'utf-8').convert_smi(outside=True))
+
+        def add():
+            m = merger()
+            m.add(top, bottom)
+            return m
+
+        def add_smi():
+            m = merger()
+            m.add(top, smi)
+            return len(m.subtitles)
+
+        merged = add()
+
+        def write():
+            merged._write(output)
+            return len(merged.subtitles)
+
+        stages = (('parse', parse, srt_bytes),
+                  ('convert_smi', convert_smi, smi_bytes),
+                  ('add', add, srt_bytes),
+                  ('add_smi', add_smi, os.path.getsize(top) + smi_bytes),
+                  ('write', write, None))
+        results = dict()
+        for name, run, size in stages:
+            seconds, peak, result = _measure(_silenced(run), repeat)
+            if name == 'add':
+                result = len(result.subtitles)
+            if size is None:
+                size = os.path.getsize(output)
+            results[name] = {
+                'seconds': seconds,
+                'cues': result,
+                'bytes': size,
+                'cues_per_second': result / seconds if seconds else 0.0,
+                'mb_per_second': size / 1e6 / seconds if seconds else 0.0,
+                'peak_memory_bytes': peak,
+                }
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare(before, after):
+    ''' print the speed ratio of every stage of two result files '''
+    with io.open(before, 'r', encoding='utf-8') as file:
+        old = json.load(file)
+    with io.open(after, 'r', encoding='utf-8') as file:
+        new = json.load(file)
+    print('%-12s %10s %10s %8s %12s' % ('stage', 'before', 'after',
+                                        'speed-up', 'peak MB'))
+    for name, measure in new['results'].items():
+        if name not in old['results']:
+            continue
+        was = old['results'][name]['seconds']
+        now = measure['seconds']
+        print('%-12s %9.4fs %9.4fs %7.2fx %5.1f->%5.1f'
+              % (name, was, now, was / now if now else 0.0,
+                 old['results'][name]['peak_memory_bytes'] / 1e6,
+                 measure['peak_memory_bytes'] / 1e6))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--cues', type=int, default=20000,
+                        help='cues per track (default: %(default)s)')
+    parser.add_argument('--overlap', type=float, default=0.1,
+                        help='share of cues overlapping the previous one '
+                             '(default: %(default)s)')
+    parser.add_argument('--cue-ms', type=int, default=2500,
+                        help='average cue length (default: %(default)s)')
+    parser.add_argument('--tag-density', type=float, default=0.2,
+                        help='share of cues with a formatting tag '
+                             '(default: %(default)s)')
+    parser.add_argument('--encoding', default='utf-8',
+                        help='encoding of the tracks, e.g. cp949 or utf-16 '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per stage, the best one is kept')
+    parser.add_argument('--legacy-merge', action='store_true',
+                        help='merge with the old per-cue insertion code')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='save the results as JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two saved results instead')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    params = {'cues': args.cues, 'overlap': args.overlap,
+              'cue_ms': args.cue_ms, 'tag_density': args.tag_density,
+              'encoding': args.encoding, 'repeat': args.repeat,
+              'legacy_merge': args.legacy_merge, 'seed': args.seed}
+    results = run_benchmarks(**params)
+    for name, measure in results.items():
+        print('%-12s %8.4fs %10.0f cues/s %7.2f MB/s %7.1f MB peak'
+              % (name, measure['seconds'], measure['cues_per_second'],
+                 measure['mb_per_second'],
+                 measure['peak_memory_bytes'] / 1e6))
+    if args.output:
+        report = {'commit': git_commit(),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'params': params,
+                  'results': results}
+        with io.open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
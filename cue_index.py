@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Byte offset index of the cues of a subtitle file.
+
+A CueIndex scans a memory-mapped SRT or SMI file once for its timings and
+the byte range of every cue, without decoding or cleaning any text. The
+cues intersecting a time window are then read by seeking to their region
+of the file and parsing only those bytes, so previewing a few minutes of a
+long file costs a timing scan instead of a full parse. Indexes are kept
+per process, keyed by path, modification time and size.
+
+Only files whose encoding passes mapped_input.byte_parsable can be
+indexed; CueIndex.build returns None for the others.
+"""
+import io
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from cue_table import CueTable
+from encoding_detect import as_cache
+from mapped_input import byte_parsable, map_file
+from smi2srt import SMI2SRT, smiItem, SYNC_BYTES_RE, P_CLASS_BYTES_RE, \
+    CONTINUATION_RE
+from srt_reader import _parse_block
+from timecodes import HRS_MS, MINS_MS, SECS_MS
+
+# a line holding nothing but blanks, which ends an SRT block
+BLANK_LINE_RE = re.compile(br'^[ \t\r\f\v]*\n', re.MULTILINE)
+TIMING_BYTES_RE = re.compile(br'[ \t]*(\d\d):(\d\d):(\d\d),(\d\d\d)[ \t]*-->'
+                             br'[ \t]*(\d\d):(\d\d):(\d\d),(\d\d\d)'
+                             br'[ \t\r]*\Z')
+# indexes kept per process, emptied when they reach MAX_ENTRIES
+MAX_ENTRIES = 64
+_indexes = dict()
+
+
+def _ms(fields):
+    return (int(fields[0]) * HRS_MS + int(fields[1]) * MINS_MS +
+            int(fields[2]) * SECS_MS + int(fields[3]))
+
+
+class CueIndex(object):
+    '''
+    Timings and byte ranges of the cues of one subtitle file, in file
+    order.
+
+    path: the indexed file
+    encoding: its detected encoding
+    starts, ends: array('q') columns of cue times in ms
+    offsets, lengths: array('q') columns of the byte range of every cue
+    classes: upper-cased <P Class=...> names of a SMI file, in order of
+             first appearance
+    '''
+    def __init__(self, path, encoding):
+        self.path = path
+        self.encoding = encoding
+        self.smi = path.lower().endswith('.smi')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.classes = []
+        self._order = []
+        self._sorted_starts = []
+        self._max_ends = []
+
+    @classmethod
+    def build(cls, path, encoding_cache=None):
+        ''' index of the file at path, or None when it cannot be indexed '''
+        stat = os.stat(path)
+        key = '%s|%d|%d' % (os.path.abspath(path), stat.st_mtime_ns,
+                            stat.st_size)
+        if key in _indexes:
+            return _indexes[key]
+        with io.open(path, 'rb') as file:
+            buffer = map_file(file)
+            if buffer is None:
+                return None
+            try:
+                detected = as_cache(encoding_cache).detect(
+                    path, fallback=not path.lower().endswith('.smi'),
+                    file=buffer)
+                encoding = (detected['encoding'] or 'utf-8').lower()
+                if not byte_parsable(encoding):
+                    return None
+                index = cls(path, encoding)
+                if index.smi:
+                    index._scan_smi(buffer)
+                else:
+                    index._scan_srt(buffer)
+            finally:
+                buffer.close()
+        index._sort()
+        if len(_indexes) >= MAX_ENTRIES:
+            _indexes.clear()
+        _indexes[key] = index
+        return index
+
+    def _add(self, start, end, offset, length):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def _scan_smi(self, buffer):
+        # a cue runs from the end of a SYNC tag to the start of the next
+        previous = None
+        for m in SYNC_BYTES_RE.finditer(buffer):
+            if previous is not None:
+                self._add(int(previous.group(1)), int(m.group(1)),
+                          previous.end(), m.start() - previous.end())
+            previous = m
+        if previous is None:
+            return
+        first = SYNC_BYTES_RE.search(buffer).start()
+        for m in P_CLASS_BYTES_RE.finditer(buffer, first):
+            name = m.group(1).decode(self.encoding, 'replace').upper()
+            if name not in self.classes:
+                self.classes.append(name)
+
+    def _scan_srt(self, buffer):
+        # blocks are runs of non blank lines, as in srt_reader
+        position = 0
+        for m in BLANK_LINE_RE.finditer(buffer):
+            if m.start() > position:
+                self._srt_block(buffer, position, m.start())
+            position = m.end()
+        if position < len(buffer):
+            self._srt_block(buffer, position, len(buffer))
+
+    def _srt_block(self, buffer, first, last):
+        # [number, timing, text...] lines between first and last
+        timing = buffer.find(b'\n', first, last) + 1
+        text = buffer.find(b'\n', timing, last) if timing else -1
+        if text < 0 or text + 1 >= last:
+            return
+        m = TIMING_BYTES_RE.match(buffer, timing, text)
+        if m is not None:
+            fields = m.groups()
+            start, end = _ms(fields[0:4]), _ms(fields[4:8])
+        else:
+            # let the reader decide: skip the block or raise ValueError
+            row = _parse_block(self._lines(buffer[first:last]))
+            if row is None:
+                return
+            start, end = row[0], row[1]
+        self._add(start, end, first, last - first)
+
+    def _sort(self):
+        # cue positions by start time, with the running maximum of their
+        # ends; cues shorter than 1 ms never show up
+        starts, ends = self.starts, self.ends
+        self._order = sorted((i for i in range(len(starts))
+                              if ends[i] > starts[i]),
+                             key=starts.__getitem__)
+        self._sorted_starts = [starts[i] for i in self._order]
+        self._max_ends = list(accumulate((ends[i] for i in self._order),
+                                         max))
+
+    def _lines(self, data):
+        lines = data.decode(self.encoding).split('\n')
+        return [line[:-1] if line.endswith('\r') else line
+                for line in lines]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intersecting(self, start_ms, end_ms):
+        ''' file positions of the cues shown in [start_ms, end_ms) '''
+        last = bisect_left(self._sorted_starts, end_ms)
+        first = bisect_right(self._max_ends, start_ms, 0, last)
+        ends = self.ends
+        return sorted(i for i in self._order[first:last]
+                      if ends[i] > start_ms)
+
+    def seek(self, time_ms):
+        ''' byte offset of the first cue (by start time) still on screen at
+        time_ms, or the size of the file if none is '''
+        first = bisect_right(self._max_ends, time_ms)
+        for i in self._order[first:]:
+            if self.ends[i] > time_ms:
+                return self.offsets[i]
+        return os.path.getsize(self.path)
+
+    def window(self, start_ms, end_ms, smi_class=None):
+        ''' CueTable of the cues shown in [start_ms, end_ms), in file
+        order, parsed from their region of the file only.
+
+        smi_class selects one <P Class=...> of a SMI file; ValueError if
+        the file has no such class.
+        '''
+        if self.smi and smi_class is not None and \
+                smi_class not in self.classes:
+            raise ValueError('%s has no %s class' % (self.path, smi_class))
+        positions = self.intersecting(start_ms, end_ms)
+        table = CueTable()
+        if not positions:
+            return table
+        region = min(self.offsets[i] for i in positions)
+        size = max(self.offsets[i] + self.lengths[i]
+                   for i in positions) - region
+        with io.open(self.path, 'rb') as file:
+            file.seek(region)
+            data = file.read(size)
+
+        if self.smi:
+            rows = []
+            for i in positions:
+                offset = self.offsets[i] - region
+                contents = data[offset:offset + self.lengths[i]].decode(
+                    self.encoding)
+                if '\n' in contents:
+                    contents = CONTINUATION_RE.sub('', contents)
+                if smi_class is None:
+                    rows.append((self.starts[i], self.ends[i], contents))
+                    continue
+                # one cue per paragraph, as SMI2SRT.convert_smi_classes
+                for name, text in SMI2SRT._split_classes(contents):
+                    if name == smi_class:
+                        rows.append((self.starts[i], self.ends[i], text))
+            texts = smiItem.srt_texts([row[2] for row in rows])
+            for (start, end, _), text in zip(rows, texts):
+                if text:
+                    table.append(start, end, text)
+            return table
+
+        for i in positions:
+            offset = self.offsets[i] - region
+            row = _parse_block(self._lines(
+                data[offset:offset + self.lengths[i]]))
+            if row is not None:
+                table.append(*row)
+        return table
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage for subtitle cues.
+
+A CueTable keeps start and end times in two array('q') columns and the text
+of every cue as UTF-8 bytes inside one shared bytearray, referenced by
+offset and length columns. Large tracks therefore cost a few machine words
+per cue instead of a MySubtitle holding a NamedTuple holding two ints and a
+str. MySubtitle views are only created when a cue is accessed.
+"""
+from array import array
+from itertools import accumulate
+
+from my_subtitle import MySubtitle
+
+
+class CueTable(object):
+    '''
+    Table of cues with start/end times in ms and a text.
+
+    Indexing returns a MySubtitle, iterating yields one MySubtitle per cue,
+    and rows() yields plain (start, end, text) tuples.
+    '''
+    __slots__ = ['starts', 'ends', 'text_offsets', 'text_lengths', 'buffer']
+
+    def __init__(self, rows=()):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.text_offsets = array('q')
+        self.text_lengths = array('q')
+        self.buffer = bytearray()
+        for start, end, text in rows:
+            self.append(start, end, text)
+
+    @classmethod
+    def from_cues(cls, cues):
+        ''' build a table from MySubtitle like objects '''
+        if isinstance(cues, CueTable):
+            return cues.copy()
+        return cls((cue.start(), cue.end(), cue.data()) for cue in cues)
+
+    @classmethod
+    def from_columns(cls, starts, ends, text_lengths, buffer):
+        ''' build a table from its columns; the texts follow each other in
+        buffer, in cue order '''
+        table = cls()
+        table.starts = array('q', starts)
+        table.ends = array('q', ends)
+        table.text_lengths = array('q', text_lengths)
+        table.text_offsets = array('q', [0])
+        table.text_offsets.extend(accumulate(table.text_lengths))
+        table.text_offsets.pop()
+        table.buffer = bytearray(buffer)
+        return table
+
+    def with_times(self, starts, ends):
+        ''' table of the same texts with other start and end columns; the
+        text buffer is shared, only the columns are copied '''
+        table = CueTable()
+        table.starts = array('q', starts)
+        table.ends = array('q', ends)
+        table.text_offsets = array('q', self.text_offsets)
+        table.text_lengths = array('q', self.text_lengths)
+        table.buffer = self.buffer
+        return table
+
+    def is_compact(self):
+        ''' True when the buffer holds the texts in cue order and nothing
+        else, as after compact() '''
+        offset = 0
+        for i in range(len(self.starts)):
+            if self.text_offsets[i] != offset:
+                return False
+            offset += self.text_lengths[i]
+        return offset == len(self.buffer)
+
+    def _store_text(self, text):
+        data = text.encode('utf-8')
+        offset = len(self.buffer)
+        self.buffer += data
+        return offset, len(data)
+
+    def append(self, start, end, text):
+        offset, length = self._store_text(text)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.text_offsets.append(offset)
+        self.text_lengths.append(length)
+
+    def append_cue(self, cue):
+        self.append(cue.start(), cue.end(), cue.data())
+
+    def extend(self, cues):
+        if isinstance(cues, CueTable):
+            for row in cues.rows():
+                self.append(*row)
+        else:
+            for cue in cues:
+                self.append_cue(cue)
+
+    def splice(self, first, last, table):
+        ''' replace cues first to last (excluded) by the cues of another
+        table; the replaced texts stay in the buffer until compact() '''
+        base = len(self.buffer)
+        self.buffer += table.buffer
+        self.starts[first:last] = table.starts
+        self.ends[first:last] = table.ends
+        self.text_offsets[first:last] = array(
+            'q', [base + offset for offset in table.text_offsets])
+        self.text_lengths[first:last] = table.text_lengths
+
+    def text(self, index):
+        offset = self.text_offsets[index]
+        return self.buffer[offset:offset+self.text_lengths[index]].decode(
+            'utf-8')
+
+    def set_text(self, index, text):
+        # the old text stays in the buffer until compact()
+        offset, length = self._store_text(text)
+        self.text_offsets[index] = offset
+        self.text_lengths[index] = length
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CueTable(self.row(i)
+                            for i in range(*index.indices(len(self))))
+        return MySubtitle(self.starts[index], self.ends[index],
+                          self.text(index))
+
+    def __delitem__(self, index):
+        del self.starts[index]
+        del self.ends[index]
+        del self.text_offsets[index]
+        del self.text_lengths[index]
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield MySubtitle(self.starts[i], self.ends[i], self.text(i))
+
+    def row(self, index):
+        return self.starts[index], self.ends[index], self.text(index)
+
+    def rows(self):
+        for i in range(len(self.starts)):
+            yield self.starts[i], self.ends[i], self.text(i)
+
+    def copy(self):
+        return CueTable(self.rows())
+
+    def compact(self):
+        ''' drop text no longer referenced by any cue from the buffer '''
+        buffer = bytearray()
+        for i in range(len(self.starts)):
+            offset = self.text_offsets[i]
+            self.text_offsets[i] = len(buffer)
+            buffer += self.buffer[offset:offset+self.text_lengths[i]]
+        self.buffer = buffer
+
+    def sort(self):
+        ''' sort cues by start time, keeping the order of equal starts '''
+        starts = self.starts
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        for name in ('starts', 'ends', 'text_offsets', 'text_lengths'):
+            column = getattr(self, name)
+            setattr(self, name, array('q', [column[i] for i in order]))
+
+    def __repr__(self):
+        return '<CueTable of %d cues>' % len(self)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding detection for subtitle files.
+
+Detection only looks at a bounded sample of the file (SAMPLE_SIZE bytes
+taken from its beginning and spread over the rest of it). Samples starting
+with a BOM, and samples that are valid UTF-8, are answered right away. A
+sample in plain ASCII says nothing of the bytes left out of it, so the
+rest of the file is then scanned for its non-ASCII lines, and those are
+the sample; a file without any is ASCII, which UTF-8 reads.
+Otherwise the detectors are fed until they are sure: cchardet first, then
+chardet, which is much slower, when cchardet is not confident enough. Both
+are imported on first use, so UTF-8 inputs never load them.
+
+Results are cached in memory by path/mtime/size and by content hash, and
+optionally in a JSON file so that merging the same source files again
+skips detection entirely.
+"""
+from __future__ import print_function
+import codecs
+import hashlib
+import importlib
+import io
+import json
+import os
+import sys
+
+SAMPLE_SIZE = 64 * 1024
+BLOCK_SIZE = 4 * 1024
+# read per step while looking for the non-ASCII lines of a file
+SCAN_SIZE = 1024 * 1024
+# saved in JSON caches; caches of another version are not read, so wrong
+# results of older versions are not kept forever
+CACHE_VERSION = 2
+# below this cchardet confidence, chardet gets a say
+CONFIDENCE = 0.99
+# named as cchardet names them; UTF-32 first as its LE BOM starts with
+# the UTF-16 one
+BOMS = ((codecs.BOM_UTF8, 'UTF-8-SIG'),
+        (codecs.BOM_UTF32_LE, 'UTF-32'), (codecs.BOM_UTF32_BE, 'UTF-32'),
+        (codecs.BOM_UTF16_LE, 'UTF-16'), (codecs.BOM_UTF16_BE, 'UTF-16'))
+
+# shared by every EncodingCache of the process; emptied when they reach
+# MAX_ENTRIES so long-lived processes do not grow forever
+MAX_ENTRIES = 4096
+_by_path = dict()
+_by_hash = dict()
+
+
+def read_sample(file, size=SAMPLE_SIZE):
+    ''' up to size bytes of an opened binary file: its first half from the
+    beginning of the file, the other half spread over the rest of it '''
+    file.seek(0, io.SEEK_END)
+    length = file.tell()
+    file.seek(0)
+    if length <= size:
+        sample = file.read()
+        file.seek(0)
+        return sample
+    head = file.read(size // 2)
+    # every block ends at a line boundary too, when it has one
+    last = head.rfind(b'\n')
+    if last >= 0:
+        head = head[:last+1]
+    blocks = [head]
+    count = (size - len(head)) // BLOCK_SIZE
+    step = (length - len(head)) // count
+    for i in range(count):
+        file.seek(len(head) + i * step)
+        block = file.read(BLOCK_SIZE)
+        # start at a line boundary so no character is cut in two
+        newline = block.find(b'\n')
+        last = block.rfind(b'\n')
+        blocks.append(block[newline+1:last+1] if newline < last else block)
+    file.seek(0)
+    return b'\n'.join(blocks)
+
+
+def non_ascii_lines(file, size=SAMPLE_SIZE):
+    ''' the lines of an opened binary file holding non-ASCII bytes, up to
+    about size bytes of them; b'' when the file is plain ASCII '''
+    lines = []
+    found = 0
+    rest = b''
+    file.seek(0)
+    while found < size:
+        block = file.read(SCAN_SIZE)
+        data = rest + block
+        if block:
+            # whole lines only, so no character is cut in two
+            last = data.rfind(b'\n') + 1
+            data, rest = data[:last], data[last:]
+        if not data.isascii():
+            for line in data.splitlines(True):
+                if not line.isascii():
+                    lines.append(line)
+                    found += len(line)
+        if not block:
+            break
+    file.seek(0)
+    return b''.join(lines)
+
+
+def _import(name):
+    # the detector packages are only loaded when a sample needs them
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        print('''%s python package not found. Please install it using
+macports or pip''' % name)
+        sys.exit()
+
+
+def _certain(sample):
+    # encoding of a sample with a BOM or in ASCII/UTF-8, or None
+    for bom, codec in BOMS:
+        if sample.startswith(bom):
+            return codec
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return 'UTF-8'
+
+
+def _feed(detector, sample):
+    for first in range(0, len(sample), BLOCK_SIZE):
+        detector.feed(sample[first:first+BLOCK_SIZE])
+        if detector.done:
+            break
+    detector.close()
+    result = detector.result
+    return result['encoding'], result['confidence'] or 0.0
+
+
+def detect_sample(sample, fallback=True):
+    ''' {'encoding': ..., 'confidence': ...} of a sample of bytes '''
+    codec = _certain(sample)
+    if codec is not None:
+        return {'encoding': codec, 'confidence': 1.0}
+    codec, confidence = _feed(_import('cchardet').UniversalDetector(),
+                              sample)
+    if fallback and confidence < CONFIDENCE:
+        chardet_codec, chardet_confidence = _feed(
+            _import('chardet').UniversalDetector(), sample)
+        if chardet_codec is not None and chardet_confidence > confidence:
+            codec, confidence = chardet_codec, chardet_confidence
+    return {'encoding': codec, 'confidence': confidence}
+
+
+def detect_file(file, fallback=True):
+    ''' {'encoding': ..., 'confidence': ...} of an opened binary file, from
+    a sample of it '''
+    sample = read_sample(file)
+    if sample.isascii():
+        file.seek(0, io.SEEK_END)
+        if file.tell() > len(sample):
+            sample = non_ascii_lines(file)
+        else:
+            file.seek(0)
+    return detect_sample(sample, fallback)
+
+
+def file_digest(file):
+    ''' content hash of an opened binary file '''
+    digest = hashlib.blake2b(digest_size=16)
+    file.seek(0)
+    for block in iter(lambda: file.read(1024 * 1024), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class EncodingCache(object):
+    '''
+    Cache of detected encodings.
+
+    path: optional JSON file the cache is loaded from and saved to; the
+          in-memory part is shared by every EncodingCache of the process
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self._loaded = path is None
+        self._paths = dict()
+        self._hashes = dict()
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as store:
+                data = json.load(store)
+            if data.get('version') != CACHE_VERSION:
+                return
+            self._paths = data.get('paths', {})
+            self._hashes = data.get('hashes', {})
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _save(self):
+        data = {'version': CACHE_VERSION, 'paths': self._paths,
+                'hashes': self._hashes}
+        temp = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with io.open(temp, 'w', encoding='utf-8') as store:
+                json.dump(data, store)
+            os.replace(temp, self.path)
+        except (IOError, OSError) as e:
+            print('Cannot save encoding cache %s: %s' % (self.path, e),
+                  file=sys.stderr)
+
+    def detect(self, file_path, fallback=True, file=None):
+        ''' detected {'encoding': ..., 'confidence': ...} of a file.
+
+        fallback: ask chardet too when cchardet is not confident
+        file: the file already opened in binary mode, if any
+        '''
+        stat = os.stat(file_path)
+        path_key = '%s|%d|%d|%d' % (os.path.abspath(file_path),
+                                    stat.st_mtime_ns, stat.st_size,
+                                    fallback)
+        if path_key in _by_path:
+            return dict(_by_path[path_key])
+        if not self._loaded:
+            self._load()
+
+        digest = self._paths.get(path_key)
+        result = None
+        if digest is not None:
+            result = _by_hash.get(digest) or self._hashes.get(digest)
+        if result is None:
+            opened = file is None
+            if opened:
+                file = io.open(file_path, 'rb')
+            try:
+                if digest is None:
+                    digest = '%s|%d' % (file_digest(file), fallback)
+                    result = _by_hash.get(digest) or self._hashes.get(digest)
+                if result is None:
+                    result = detect_file(file, fallback)
+            finally:
+                if opened:
+                    file.close()
+
+        if len(_by_path) >= MAX_ENTRIES:
+            _by_path.clear()
+        if len(_by_hash) >= MAX_ENTRIES:
+            _by_hash.clear()
+        _by_path[path_key] = result
+        _by_hash[digest] = result
+        if self.path is not None and (self._paths.get(path_key) != digest or
+                                      digest not in self._hashes):
+            self._paths[path_key] = digest
+            self._hashes[digest] = result
+            self._save()
+        return dict(result)
+
+
+def as_cache(cache):
+    ''' EncodingCache from an EncodingCache, a JSON file path or None '''
+    if isinstance(cache, EncodingCache):
+        return cache
+    return EncodingCache(cache)
+
+
+def detect_encoding(file_path, fallback=True, cache=None, file=None):
+    ''' detected encoding of a file, see EncodingCache.detect '''
+    return as_cache(cache).detect(file_path, fallback, file)
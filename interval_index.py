@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Interval index over a list of subtitles kept in start time order.
+
+The index is a treap (randomized balanced binary tree) whose in-order walk
+is the list of subtitles. Every node keeps the size of its subtree, which
+gives positional inserts/removals, and the maximum end time of its subtree,
+which lets overlap queries skip whole subtrees that finish too early.
+Inserts, removals and "what is on screen at t" queries are all O(log n)
+(plus the number of subtitles returned).
+"""
+import random
+
+
+class _Node(object):
+    __slots__ = ['cue', 'start', 'end', 'priority',
+                 'left', 'right', 'size', 'max_end']
+
+    def __init__(self, cue, priority):
+        self.cue = cue
+        self.start = cue.start()
+        self.end = cue.end()
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.size = 1
+        self.max_end = self.end
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = 1
+    node.max_end = node.end
+    left = node.left
+    right = node.right
+    if left is not None:
+        node.size += left.size
+        if left.max_end > node.max_end:
+            node.max_end = left.max_end
+    if right is not None:
+        node.size += right.size
+        if right.max_end > node.max_end:
+            node.max_end = right.max_end
+
+
+def _split(node, count):
+    # splits node into (first count subtitles, the others)
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if count <= left_size:
+        first, node.left = _split(node.left, count)
+        _update(node)
+        return first, node
+    node.right, second = _split(node.right, count - left_size - 1)
+    _update(node)
+    return node, second
+
+
+def _merge(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    if first.priority > second.priority:
+        first.right = _merge(first.right, second)
+        _update(first)
+        return first
+    second.left = _merge(first, second.left)
+    _update(second)
+    return second
+
+
+class IntervalIndex(object):
+    '''
+    Positional interval index of subtitles sorted by start time.
+
+    Subtitles are MySubtitle like objects exposing start() and end().
+    Positions are the ones the subtitles have in the indexed list, and the
+    index supports len(), indexing and iteration, so it can stand in for
+    that list (as the legacy Merger timeline does) rather than be kept
+    next to it.
+    '''
+    def __init__(self, subtitles=()):
+        self._random = random.Random()
+        self.root = self._build(list(subtitles))
+
+    def _build(self, subtitles):
+        # builds a balanced tree and hands out random priorities level by
+        # level, so that the heap order of a treap holds from the start
+        count = len(subtitles)
+        if count == 0:
+            return None
+        priorities = sorted((self._random.random() for _ in range(count)),
+                            reverse=True)
+        nodes = [None] * count
+        levels = [(0, count)]
+        next_priority = 0
+        while levels:
+            lower = []
+            for low, high in levels:
+                middle = (low + high) // 2
+                nodes[middle] = _Node(subtitles[middle],
+                                      priorities[next_priority])
+                next_priority += 1
+                if low < middle:
+                    lower.append((low, middle))
+                if middle + 1 < high:
+                    lower.append((middle + 1, high))
+            levels = lower
+
+        def link(low, high):
+            if low >= high:
+                return None
+            middle = (low + high) // 2
+            node = nodes[middle]
+            node.left = link(low, middle)
+            node.right = link(middle + 1, high)
+            _update(node)
+            return node
+        return link(0, count)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __iter__(self):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.cue
+            node = node.right
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('IntervalIndex index out of range')
+        node = self.root
+        while True:
+            left_size = _size(node.left)
+            if position < left_size:
+                node = node.left
+            elif position == left_size:
+                return node.cue
+            else:
+                position -= left_size + 1
+                node = node.right
+
+    def insert(self, position, cue):
+        ''' insert cue so that it ends up at position '''
+        first, second = _split(self.root, position)
+        node = _Node(cue, self._random.random())
+        self.root = _merge(_merge(first, node), second)
+
+    def add(self, cue):
+        ''' insert cue after every subtitle starting at or before it '''
+        self.insert(self.bisect(cue.start()), cue)
+
+    def pop(self, position):
+        ''' remove and return the subtitle at position '''
+        if not 0 <= position < len(self):
+            raise IndexError('pop index out of range')
+        first, rest = _split(self.root, position)
+        node, second = _split(rest, 1)
+        self.root = _merge(first, second)
+        return node.cue
+
+    def bisect(self, time):
+        ''' number of subtitles starting at or before time '''
+        position = 0
+        node = self.root
+        while node is not None:
+            if time < node.start:
+                node = node.left
+            else:
+                position += _size(node.left) + 1
+                node = node.right
+        return position
+
+    def first_ending_after(self, time):
+        ''' position of the first subtitle still on screen after time,
+        len(self) if every subtitle ended at or before time
+        '''
+        position = 0
+        node = self.root
+        while node is not None and node.max_end > time:
+            left = node.left
+            if left is not None and left.max_end > time:
+                node = left
+            elif node.end > time:
+                return position + _size(left)
+            else:
+                position += _size(left) + 1
+                node = node.right
+        return len(self)
+
+    def overlapping(self, start, end):
+        ''' subtitles shown anywhere in [start, end), in start order '''
+        found = []
+        stack = [self.root]
+        # a node is expanded the first time it is seen and emitted the
+        # second time, which keeps the result in order without recursion
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if isinstance(node, _Node):
+                if node.max_end <= start:
+                    continue
+                if node.start < end:
+                    stack.append(node.right)
+                    stack.append((node,))
+                stack.append(node.left)
+            else:
+                node = node[0]
+                if node.end > start:
+                    found.append(node.cue)
+        return found
+
+    def at(self, time):
+        ''' subtitles on screen at time (in ms) '''
+        return self.overlapping(time, time + 1)
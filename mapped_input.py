@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped reading of subtitle files.
+
+A mapped file is read by the OS page by page as it is scanned, instead of
+being copied into a bytes object and decoded into a str as a whole. Tags
+and timings can be searched for in the mapped bytes themselves as long as
+the bytes of ASCII markup characters always stand for those characters in
+the encoding of the file; that holds for UTF-8, the single byte code
+pages and the usual CJK double byte encodings (CP949, EUC-KR, Shift_JIS,
+GBK, Big5), whose trailing bytes never fall below 0x40. UTF-16/32 and the
+stateful encodings (ISO-2022, UTF-7, HZ) do not qualify.
+"""
+import codecs
+import mmap
+
+# every character the SMI/SRT parsers look for in raw bytes
+PROBE = u'\r\n\t <>=/"\':,-0123456789'
+# encodings keeping ASCII bytes as they are, but only after a shift
+STATEFUL = ('iso2022', 'utf_7', 'utf-7', 'hz')
+
+
+def byte_parsable(encoding):
+    ''' True when markup can be searched for in the raw bytes of a file in
+    encoding, see the module documentation '''
+    try:
+        name = codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return False
+    if name.replace('-', '_').startswith(STATEFUL):
+        return False
+    try:
+        encoded = PROBE.encode(name)
+    except UnicodeError:
+        return False
+    # utf-8-sig only differs from utf-8 by its BOM
+    if encoded.startswith(codecs.BOM_UTF8):
+        encoded = encoded[len(codecs.BOM_UTF8):]
+    return encoded == PROBE.encode('ascii')
+
+
+def map_file(file):
+    ''' read-only mmap of an opened binary file, or None when it cannot be
+    mapped (empty files, pipes, ...) '''
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError, AttributeError):
+        return None
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Sweep-line merge engine used by Merger.
+
+Rather than inserting every cue into the merged list one at a time (which
+splits and rebuilds the list on each overlap), the start/end boundaries of
+every track are sorted once per track and k-way merged through a heap, then
+swept left to right. Between two consecutive boundaries the text of every
+cue on screen is concatenated following the stacking order of the tracks,
+which is exactly what the per-cue insertion in Merger._check_times produces.
+"""
+import heapq
+from bisect import bisect_left, insort
+
+from cue_table import CueTable
+
+
+def _rows(track):
+    if isinstance(track, CueTable):
+        return track.rows()
+    return ((cue.start(), cue.end(), cue.data()) for cue in track)
+
+
+def _track_events(track, base, texts):
+    # sorted (time, is_start, rank) boundaries of a single track; ranks
+    # start at base so that tracks stacked higher always come first
+    events = []
+    rank = base
+    for start, end, text in _rows(track):
+        if end > start:
+            texts[rank] = text
+            # ends sort before starts at the same time so that a cue ending
+            # exactly where another begins never shares a segment with it
+            events.append((start, 1, rank))
+            events.append((end, 0, rank))
+        rank += 1
+    # tracks are nearly always in time order already, which keeps this sort
+    # close to linear
+    events.sort()
+    return events
+
+
+def sweep_merge(tracks, order=None):
+    """ Merge a list of tracks (each a CueTable or a sequence of MySubtitle)
+    into a single CueTable of non-overlapping cues.
+
+    order lists the indices of tracks from top to bottom and defaults to
+    the order of tracks. Inside a track, cues keep their file order. Cues
+    that do not last at least one millisecond are dropped.
+
+    Each track is sorted on its own and the k sorted streams are merged
+    through a heap, so the sweep costs O(total cues * log k).
+    """
+    if order is None:
+        order = range(len(tracks))
+    texts = [None] * sum(len(tracks[index]) for index in order)
+    streams = []
+    base = 0
+    for index in order:
+        track = tracks[index]
+        streams.append(_track_events(track, base, texts))
+        base += len(track)
+
+    merged = CueTable()
+    active = []
+    last_time = None
+    for time, is_start, rank in heapq.merge(*streams):
+        if active and time != last_time:
+            merged.append(last_time, time,
+                          '\n'.join([texts[r] for r in active]))
+        last_time = time
+        if is_start:
+            insort(active, rank)
+        else:
+            del active[bisect_left(active, rank)]
+    return merged
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Long-lived subtitle merge service.
+
+Usage:
+$python merge_server.py [--port 8765] [--unix /tmp/merge.sock] [-j 4]
+
+The server speaks a minimal HTTP/1.1 over TCP and/or a Unix socket:
+
+POST /merge   JSON body {"subtitles": [{"name": "movie.ko.smi",
+                                        "data": "<base64>"}, ...],
+                         "encoding": "utf-8", "order": [2, 1]}
+              subtitles are stacked from top to bottom (or as listed by
+              the optional 1-based order); a name like "movie.smi#ENCC"
+              selects one class of a SMI file. Answers the merged SRT.
+GET /metrics  JSON counters, concurrency limits and queue depth
+GET /health   "ok"
+
+Merges run in a pool of worker processes, so the interpreter and imports
+are paid once per worker and the event loop only moves bytes around. At
+most --jobs merges run at once; up to --max-queue more wait for a worker,
+and further requests are answered 503 right away.
+"""
+from __future__ import print_function
+import asyncio
+import base64
+import binascii
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+from sub_merger import Merger
+
+MAX_BODY = 64 * 1024 * 1024
+MAX_QUEUE = 64
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class MergeError(Exception):
+    ''' a merge request that cannot be served, with its HTTP status '''
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def merge_payload(subtitles, encoding='utf-8', order=None):
+    ''' (merged SRT bytes, cues) of a list of (name, data) subtitles.
+
+    Runs inside a worker process; the subtitles are written to a temporary
+    directory and merged with a Merger. Raises MergeError on bad input.
+    '''
+    messages = io.StringIO()
+    with tempfile.TemporaryDirectory(prefix='merge-') as directory:
+        addresses = []
+        written = dict()
+        for i, (name, data) in enumerate(subtitles):
+            name, sep, smi_class = os.path.basename(name).partition('#')
+            # the extension tells the format, else the content is sniffed
+            name = name or 'subtitle.srt'
+            path = written.get((name, data))
+            if path is None:
+                # one directory per input so every file keeps its own name
+                os.mkdir(os.path.join(directory, str(i)))
+                path = os.path.join(directory, str(i), name)
+                with io.open(path, 'wb') as file:
+                    file.write(data)
+                written[(name, data)] = path
+            addresses.append(path + sep + smi_class)
+        output = io.BytesIO()
+        try:
+            with redirect_stdout(messages):
+                m = Merger(output_file=os.path.join(directory, 'merged.srt'),
+                           output_encoding=encoding)
+                m.add_tracks(addresses, order)
+                m._write(output)
+        except (Exception, SystemExit) as e:
+            # Merger prints what is wrong with the input, then exits
+            error = ' '.join(messages.getvalue().split()) or \
+                '%s: %s' % (type(e).__name__, e)
+            for i in range(len(subtitles)):
+                error = error.replace(os.path.join(directory, str(i), ''), '')
+            raise MergeError(error)
+    return output.getvalue(), len(m.subtitles)
+
+
+def _parse_request(body):
+    # (subtitles, encoding, order) of a /merge JSON body
+    try:
+        request = json.loads(body.decode('utf-8'))
+        subtitles = [(str(item['name']),
+                      base64.b64decode(item['data'], validate=True))
+                     for item in request['subtitles']]
+    except (ValueError, KeyError, TypeError, binascii.Error) as e:
+        raise MergeError('invalid merge request: %s' % e)
+    if len(subtitles) < 2:
+        raise MergeError('at least two subtitles are needed to merge')
+    for name, _ in subtitles:
+        # every file is written under its own name in the temp directory
+        if os.path.basename(name).partition('#')[0] in ('', '.', '..'):
+            raise MergeError('invalid subtitle name %r' % (name,))
+    encoding = request.get('encoding') or 'utf-8'
+    try:
+        ''.encode(encoding)
+    except (LookupError, TypeError):
+        raise MergeError('unknown encoding %r' % (encoding,))
+    order = request.get('order')
+    if order is not None:
+        try:
+            order = [int(n) - 1 for n in order]
+        except (ValueError, TypeError):
+            raise MergeError('order takes a list of numbers')
+        if sorted(order) != list(range(len(subtitles))):
+            raise MergeError('order must list every subtitle exactly once')
+    return subtitles, encoding, order
+
+
+def _ready():
+    # run once per worker by MergeServer.start
+    return os.getpid()
+
+
+class MergeServer(object):
+    '''
+    asyncio merge service.
+
+    workers: worker processes, and merges running at once (default: number
+             of cores)
+    max_queue: merges allowed to wait for a worker before requests are
+               rejected with 503
+    max_body: largest request body accepted, in bytes
+    '''
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, max_body=MAX_BODY):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_body = max_body
+        self._executor = None
+        self._slots = None
+        self._servers = []
+        self.started = time.time()
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.connections = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cues = 0
+        self.merge_seconds = 0.0
+
+    def metrics(self):
+        ''' counters of the server as a dict '''
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'active': self.active,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'connections': self.connections,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'cues': self.cues,
+            'merge_seconds': self.merge_seconds,
+            'uptime_seconds': time.time() - self.started,
+            }
+
+    async def start(self, host='127.0.0.1', port=8765, unix_path=None):
+        ''' listen on host:port (unless port is None) and on unix_path '''
+        # forked workers would inherit the listening sockets and whatever
+        # client connection is open when they start, which then never
+        # sees its end; forkserver and spawn workers start clean
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in methods else 'spawn')
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=context)
+        self._slots = asyncio.Semaphore(self.workers)
+        # workers start (and import the merger) before the first request
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._executor, _ready)
+                               for _ in range(self.workers)])
+        if port is not None:
+            self._servers.append(await asyncio.start_server(
+                self._handle, host, port))
+        if unix_path is not None:
+            self._servers.append(await asyncio.start_unix_server(
+                self._handle, unix_path))
+        return [s.sockets[0].getsockname() for s in self._servers]
+
+    async def serve_forever(self):
+        await asyncio.gather(*[s.serve_forever() for s in self._servers])
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def merge(self, subtitles, encoding='utf-8', order=None):
+        ''' merged SRT bytes and cue count, computed in a worker process '''
+        if self.queued >= self.max_queue and self.active >= self.workers:
+            self.rejected += 1
+            raise MergeError('too many merges waiting', 503)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        started = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            merged, cues = await loop.run_in_executor(
+                self._executor, merge_payload, subtitles, encoding, order)
+        except MergeError:
+            self.failed += 1
+            raise
+        except Exception as e:
+            self.failed += 1
+            raise MergeError('%s: %s' % (type(e).__name__, e), 500)
+        finally:
+            self.active -= 1
+            self.merge_seconds += time.time() - started
+            self._slots.release()
+        self.completed += 1
+        self.cues += cues
+        return merged, cues
+
+    async def _read_request(self, reader):
+        # (method, path, body) of one HTTP request, None on a closed stream
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, path, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise MergeError('malformed request line')
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                try:
+                    length = int(value.strip())
+                except ValueError:
+                    raise MergeError('invalid Content-Length')
+        if length > self.max_body:
+            raise MergeError('request body over %d bytes' % self.max_body,
+                             413)
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), path.split('?', 1)[0], body
+
+    async def _respond(self, writer, status, body,
+                       content_type='application/json', headers=()):
+        head = ['HTTP/1.1 %d %s' % (status, REASONS.get(status, '')),
+                'Content-Type: %s' % content_type,
+                'Content-Length: %d' % len(body),
+                'Connection: close']
+        head.extend('%s: %s' % header for header in headers)
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+    async def _route(self, method, path, body):
+        # (status, body, content type, extra headers) of a request
+        if path == '/merge':
+            if method != 'POST':
+                raise MergeError('use POST', 405)
+            subtitles, encoding, order = _parse_request(body)
+            merged, cues = await self.merge(subtitles, encoding, order)
+            return (200, merged, 'application/x-subrip; charset=%s'
+                    % encoding, [('X-Cues', cues)])
+        if path == '/metrics' and method == 'GET':
+            return (200, json.dumps(self.metrics()).encode('utf-8'),
+                    'application/json', [])
+        if path == '/health' and method == 'GET':
+            return 200, b'ok', 'text/plain', []
+        raise MergeError('no such endpoint %s %s' % (method, path), 404)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            try:
+                request = await self._read_request(reader)
+                if request is None:
+                    return
+                status, body, content_type, headers = \
+                    await self._route(*request)
+            except MergeError as e:
+                status, content_type, headers = e.status, \
+                    'application/json', []
+                body = json.dumps({'error': str(e)}).encode('utf-8')
+            except asyncio.IncompleteReadError:
+                return
+            await self._respond(writer, status, body, content_type, headers)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+
+async def _main(args):
+    server = MergeServer(args.jobs, args.max_queue,
+                         args.max_body * 1024 * 1024)
+    port = None if args.no_tcp else args.port
+    for address in await server.start(args.host, port, args.unix):
+        print('Listening on %s' % (address,))
+    sys.stdout.flush()
+    serving = asyncio.ensure_future(server.serve_forever())
+    # a terminated server stops its workers too, rather than leaving them
+    # waiting for work that never comes
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Serve subtitle merges over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='TCP port (default: %(default)s)')
+    parser.add_argument('--no-tcp', action='store_true',
+                        help='only listen on the Unix socket')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='also listen on this Unix socket')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: number of cores)')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                        help='merges waiting for a worker before new ones '
+                             'are rejected (default: %(default)s)')
+    parser.add_argument('--max-body', type=int, default=MAX_BODY >> 20,
+                        metavar='MB',
+                        help='largest request accepted (default: '
+                             '%(default)s)')
+    args = parser.parse_args()
+    if args.no_tcp and args.unix is None:
+        parser.error('--no-tcp needs --unix')
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
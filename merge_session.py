@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental re-merging of a bottom track against a fixed top track.
+
+A MergeSession parses the top track once and keeps the merged timeline.
+When a new version of the bottom track is submitted, it is diffed cue by
+cue against the previous one (as multisets, with a sequence diff only when
+cues moved inside the file) and only the time windows touched by changed
+cues are merged again.
+
+A window starts as the span of the changed cues and grows over every cue
+of either track that touches it, until it is closed. The merged timeline
+never has a segment crossing the bounds of such a window, and inside it
+the segments only depend on the cues of the window. Sweeping those cues
+alone, with the tracks and the file order stacked as before, therefore
+gives the same segments a full rebuild would.
+"""
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from difflib import SequenceMatcher
+from itertools import accumulate
+
+from cue_table import CueTable
+from merge_engine import sweep_merge
+from sub_merger import Merger
+
+
+class _SpanIndex(object):
+    # cues of a track sorted by start, with the running maximum of their
+    # end times; finds the cues touching a time window in O(log n)
+    def __init__(self, rows):
+        self.rows = rows
+        # cues shorter than 1 ms never reach the merged timeline
+        self.order = sorted((i for i in range(len(rows))
+                             if rows[i][1] > rows[i][0]),
+                            key=lambda i: rows[i][0])
+        self.starts = [rows[i][0] for i in self.order]
+        self.max_ends = list(accumulate((rows[i][1] for i in self.order),
+                                        max))
+
+    def _bounds(self, lo, hi):
+        last = bisect_right(self.starts, hi)
+        return bisect_left(self.max_ends, lo, 0, last), last
+
+    def expand(self, lo, hi):
+        ''' (lo, hi) grown over every cue touching [lo, hi] '''
+        first, last = self._bounds(lo, hi)
+        if first == last:
+            return lo, hi
+        return (min(lo, self.starts[first]),
+                max(hi, self.max_ends[last - 1]))
+
+    def touching(self, lo, hi):
+        ''' CueTable of the cues touching [lo, hi], in file order '''
+        first, last = self._bounds(lo, hi)
+        rows = self.rows
+        return CueTable(rows[i] for i in sorted(self.order[first:last])
+                        if rows[i][1] >= lo)
+
+
+def _without(rows, removed):
+    # rows minus the earliest occurrences of the rows counted in removed
+    removed = Counter(removed)
+    kept = []
+    for row in rows:
+        if removed[row] > 0:
+            removed[row] -= 1
+        else:
+            kept.append(row)
+    return kept
+
+
+def _changed_rows(old, new):
+    # rows of old and new that are not matched by the diff of the two
+    old_counts = Counter(old)
+    new_counts = Counter(new)
+    removed = old_counts - new_counts
+    added = new_counts - old_counts
+    changed = list(removed.elements()) + list(added.elements())
+    old_kept = _without(old, removed) if removed else old
+    new_kept = _without(new, added) if added else new
+    if old_kept != new_kept:
+        # cues moved inside the file; the stacking of overlapping cues
+        # follows the file order, so the moved ones changed too
+        matcher = SequenceMatcher(None, old_kept, new_kept, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != 'equal':
+                changed.extend(old_kept[i1:i2])
+                changed.extend(new_kept[j1:j2])
+    return changed
+
+
+def _merge_windows(windows):
+    windows.sort()
+    merged = []
+    for lo, hi in windows:
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class MergeSession(object):
+    '''
+    Merge session of a fixed top track with successive versions of a
+    bottom track.
+
+    top: path of the top track, or a CueTable
+    bottom: path of the first version of the bottom track, or a CueTable
+    merger_options: passed to the Merger used to read and write tracks
+                    (output_file, output_encoding, encoding_cache, ...)
+    '''
+    def __init__(self, top, bottom, **merger_options):
+        self.merger = Merger(**merger_options)
+        self.top = self._track(top)
+        self._top_index = _SpanIndex(list(self.top.rows()))
+        self.bottom = self._track(bottom)
+        self._bottom_rows = list(self.bottom.rows())
+        self.merger.subtitles = sweep_merge([self.top, self.bottom])
+        self.merger.tracks = [self.top, self.bottom]
+        self.last_update = None
+
+    @property
+    def subtitles(self):
+        ''' the merged CueTable '''
+        return self.merger.subtitles
+
+    def _track(self, track):
+        if isinstance(track, CueTable):
+            return track
+        return self.merger._read_track(track)
+
+    def update(self, bottom):
+        ''' merge a new version of the bottom track (a path or a CueTable).
+
+        Returns a dict with the number of changed cues, re-merged windows
+        and merged cues replaced.
+        '''
+        bottom = self._track(bottom)
+        rows = list(bottom.rows())
+        changed = _changed_rows(self._bottom_rows, rows)
+        bottom_index = _SpanIndex(rows)
+
+        windows = _merge_windows([(start, end) for start, end, text
+                                  in changed if end > start])
+        while True:
+            grown = []
+            for lo, hi in windows:
+                lo, hi = self._top_index.expand(lo, hi)
+                grown.append(bottom_index.expand(lo, hi))
+            grown = _merge_windows(grown)
+            if grown == windows:
+                break
+            windows = grown
+
+        merged = self.merger.subtitles
+        replaced = 0
+        # from the last window so earlier positions stay valid
+        for lo, hi in reversed(windows):
+            first = bisect_left(merged.starts, lo)
+            last = bisect_right(merged.starts, hi, first)
+            part = sweep_merge([self._top_index.touching(lo, hi),
+                                bottom_index.touching(lo, hi)])
+            merged.splice(first, last, part)
+            replaced += last - first
+        if len(merged.buffer) > 2 * sum(merged.text_lengths) + 4096:
+            merged.compact()
+
+        self.bottom = bottom
+        self._bottom_rows = rows
+        self.merger.tracks = [self.top, bottom]
+        self.merger._index = None
+        self.last_update = {'changed': len(changed),
+                            'windows': len(windows),
+                            'replaced': replaced}
+        return self.last_update
+
+    def write(self, output=None):
+        ''' write the merged subtitles, see Merger._write '''
+        self.merger._write(output)
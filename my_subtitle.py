@@ -4,18 +4,13 @@ Created on Tue Oct  2 18:26:02 2018
 
 @author: christoper slycord
 """
-import sys
 from builtins import str
-try:
-    import typing
-except ImportError:
-    print('''typing python package not found. Please install it using
-macports or pip''')
-    sys.exit()
+from collections import namedtuple
+from timecodes import ms_to_timestamp
 
-Subtitle = typing.NamedTuple('Subtitle', [('start_times', int),
-                                          ('end_times', int),
-                                          ('subtitles', str)])
+# a plain namedtuple: the typing module alone takes longer to import than
+# the rest of the CLI startup
+Subtitle = namedtuple('Subtitle', ['start_times', 'end_times', 'subtitles'])
     
 class MySubtitle():
     __slots__ = ['sub']
@@ -53,23 +48,14 @@ class MySubtitle():
         return self.sub.subtitles
 
     def set_start(self, time):
-        self.sub.start_times = time
+        # Subtitle is a namedtuple, replaced rather than changed
+        self.sub = self.sub._replace(start_times=int(time))
+
+    def set_end(self, time):
+        self.sub = self.sub._replace(end_times=int(time))
 
     def ms2TS(self, time_ms):
-        hrs_ms = int(3600000)
-        mins_ms = int(60000)
-        secs_ms = int(1000)
-        
-        ms = time_ms
-        
-        hours = ms // hrs_ms
-        ms -= hours * hrs_ms
-        minutes = ms // mins_ms
-        ms -= minutes * mins_ms
-        seconds = ms // secs_ms
-        ms -= seconds * secs_ms
-        s = '%02d:%02d:%02d,%03d' % (hours, minutes, seconds, ms)
-        return s
+        return ms_to_timestamp(time_ms)
 
     def timestamp(self):
         return self.ms2TS(self.start()) + " --> " + self.ms2TS(self.end())
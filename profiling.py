@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-stage instrumentation of Merger and SMI2SRT.
+
+A StageProfiler records, for every named stage, the wall time spent in it,
+how many times it ran, and whatever counters the stage reports (cues,
+splits, bytes read or written, ...). Times are inclusive: the add stage
+also holds the detect, split_dialogs and merge stages it went through.
+
+Objects that are not profiled use NULL_PROFILER, whose stages and counters
+do nothing, so instrumented code costs one attribute lookup when off.
+"""
+import functools
+import time
+from collections import OrderedDict
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler(object):
+    ''' profiler recording nothing '''
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, **counters):
+        pass
+
+    def report(self):
+        return {'stages': OrderedDict(), 'total_seconds': 0.0}
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage(object):
+    __slots__ = ['record', 'started']
+
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc_info):
+        self.record['seconds'] += time.perf_counter() - self.started
+        self.record['calls'] += 1
+        return False
+
+
+class StageProfiler(object):
+    '''
+    Wall time, calls and counters of named stages.
+
+    with profiler.stage('write'):
+        ...
+    profiler.count('write', bytes_written=n)
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.started = time.perf_counter()
+
+    def _record(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = OrderedDict(
+                [('seconds', 0.0), ('calls', 0)])
+        return record
+
+    def stage(self, name):
+        ''' context manager timing one run of a stage '''
+        return _Stage(self._record(name))
+
+    def count(self, name, **counters):
+        ''' add counters to a stage '''
+        record = self._record(name)
+        for counter, value in counters.items():
+            record[counter] = record.get(counter, 0) + value
+
+    def report(self):
+        ''' {'stages': {name: {'seconds', 'calls', counters...}},
+        'total_seconds': time since the profiler was created} '''
+        return {'stages': OrderedDict((name, OrderedDict(record))
+                                      for name, record in self.stages.items()),
+                'total_seconds': time.perf_counter() - self.started}
+
+
+def as_profiler(profile):
+    ''' StageProfiler from True or a StageProfiler, NULL_PROFILER from
+    False or None '''
+    if isinstance(profile, (StageProfiler, NullProfiler)):
+        return profile
+    return StageProfiler() if profile else NULL_PROFILER
+
+
+def profiled(name):
+    ''' time every call of a method as the stage name of self.profiler '''
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+            with profiler.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
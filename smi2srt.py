@@ -9,7 +9,15 @@ import sys
 import re
 import logging
 import io
+from collections import OrderedDict
+from itertools import islice
 from my_subtitle import MySubtitle
+from cue_table import CueTable
+from timecodes import ms_to_timestamp, format_timings
+from encoding_detect import as_cache
+from srt_writer import SRTWriter
+from profiling import as_profiler, profiled
+from mapped_input import byte_parsable, map_file
 
 __author__ = "steven <mcchae@gmail.com>"
 __date__ = "2014/02/15"
@@ -58,15 +66,35 @@ w/ the associated srt merger I've written
 Refactored code as best as I could to simplify
 '''
 
-try:
-    import cchardet as detector
-except ImportError:
-    print('''cchardet python package not found. Please install it using
-macports or pip''')
-    sys.exit()
-
 logger = logging.getLogger(__name__)
 
+# <SYNC Start=nnnn ...>, the start time may be quoted
+SYNC_RE = re.compile(r'<sync\s+start\s*=\s*["\']?(\d+)["\']?[^>]*>',
+                     re.IGNORECASE)
+# SYNC_RE for the raw bytes of a document, see mapped_input.py
+SYNC_BYTES_RE = re.compile(br'<sync\s+start\s*=\s*["\']?(\d+)["\']?[^>]*>',
+                           re.IGNORECASE)
+# SYNC blocks cleaned per call to smiItem.srt_texts while converting
+CLEAN_BATCH = 4096
+# <P Class=XXXX ...>, the class name may be quoted
+P_CLASS_RE = re.compile(r'<p\s[^>]*?class\s*=\s*["\']?([^"\'\s>]+)'
+                        r'["\']?[^>]*>', re.IGNORECASE)
+# P_CLASS_RE for the raw bytes of a document
+P_CLASS_BYTES_RE = re.compile(br'<p\s[^>]*?class\s*=\s*["\']?([^"\'\s>]+)'
+                              br'["\']?[^>]*>', re.IGNORECASE)
+# a line break and the indentation of the next line
+CONTINUATION_RE = re.compile(r'\n\s*')
+# consecutive <br>, <br/> or <br /> tags
+BR_RE = re.compile(r'<[bB][rR]\s*/?>(?:<[bB][rR]\s*/?>)*')
+# any tag but <b>, <i>, <u> and their closing tags (an unclosed one runs
+# to the end of its SYNC block), or a comment; neither may run past the
+# CUE_SEPARATOR ending the block
+DROPPED_TAG_RE = re.compile(r'<(?:/?(?![biuBIU][\s>/])[A-Za-z][^>\x00]*'
+                            r'(?:>|(?=\x00|\Z))|!--[^\x00]*?-->)')
+ENTITY_RE = re.compile(r'&[a-z]{2,5};')
+# joins the contents of SYNC blocks cleaned together by smiItem.srt_texts
+CUE_SEPARATOR = '\x00'
+
 # -----------------------------------------------------------------------------
 #            SMI to SRT
 # -----------------------------------------------------------------------------
@@ -83,50 +111,51 @@ class smiItem(object):
 
     @staticmethod
     def ms2ts(ms):
-        MS_TO_HOURS = int(3600000)
-        MS_TO_MINUTES = int(60000)
-        MS_TO_SECONDS = int(1000)
-
-        hours = ms // MS_TO_HOURS
-        ms -= hours * MS_TO_HOURS
-        minutes = ms // MS_TO_MINUTES
-        ms -= minutes * MS_TO_MINUTES
-        seconds = ms // MS_TO_SECONDS
-        ms -= seconds * MS_TO_SECONDS
-        s = '%02d:%02d:%02d,%03d' % (hours, minutes, seconds, ms)
-        return s
+        return ms_to_timestamp(ms)
 
-    def convertSrt(self, outside=False):
+    @staticmethod
+    def srt_texts(lines):
+        ''' SRT texts of the contents of many SYNC blocks at once.
+
+        The contents are joined and cleaned by a few compiled, linear passes
+        over the whole batch: whitespace runs become one space, runs of
+        <br> become a line break, tags other than <b>, <i> and <u> (and
+        comments) are dropped, entities are removed, and lines are stripped
+        of spaces with empty ones removed.
+        '''
+        if len(lines) == 0:
+            return []
+        batch = CUE_SEPARATOR.join(lines)
+        if batch.count(CUE_SEPARATOR) != len(lines) - 1:
+            lines = [line.replace(CUE_SEPARATOR, '') for line in lines]
+            batch = CUE_SEPARATOR.join(lines)
+        # 1) remove new-line
+        batch = ' '.join(batch.split())
+        # 2) replace "<br>" with '\n';
+        batch = BR_RE.sub('\n', batch)
+        # 3) drop every tag but <b>, <i> and <u>
+        batch = DROPPED_TAG_RE.sub('', batch)
+        # 4) remove web string like "&nbsp";
+        batch = ENTITY_RE.sub('', batch)
+        # 5) strip lines, SRT dialogs cannot hold empty ones
+        batch = '\n'.join([x for x in [x.strip(' ')
+                                       for x in batch.split('\n')] if x])
+        texts = [x.strip(' \n') for x in batch.split(CUE_SEPARATOR)]
+        if len(texts) != len(lines):
+            # a pass ate a separator, which would shift every following
+            # text onto the times of another cue; clean them one by one
+            return [smiItem.srt_texts([line])[0] for line in lines]
+        return texts
 
-        line = self.MySub.sub.subtitles
+    @staticmethod
+    def srt_text(line):
+        ''' SRT text of the contents of a SYNC block '''
+        return smiItem.srt_texts([line])[0]
 
-        # 1) remove new-line
-        line = re.sub(r'\s+', ' ', line)
-        # 2) remove web string like "&nbsp";
-        line = re.sub(r'&[a-z]{2,5};', '', line)
-        # 3) replace "<br>" with '\n';
-        line = re.sub(r'(<br>)+', '\n', line, flags=re.IGNORECASE)
-        # 4) find all tags
-        fndx = line.find('<')
-        if fndx >= 0:
-            sb = line[0:fndx]
-            contents = line[fndx:]
-            while True:
-                m = re.match(r'</?([a-z]+)[^>]*>([^<>]*)', contents,
-                                   flags=re.IGNORECASE)
-                if m is None:
-                    break
-                contents = contents[m.end(2):]
-                if m.group(1).lower() in ['b', 'i', 'u']:
-                    sb += m.string[0:m.start(2)]
-                sb += m.group(2)
-            final_line = ''
-            for x in sb.splitlines(True):
-                final_line += x.strip(' ')
-            sb = final_line.rstrip('\n')
-            self.MySub = MySubtitle(self.MySub.sub.start_times,
-                                    self.MySub.sub.end_times,
-                                    sb)
+    def convertSrt(self, outside=False):
+        self.MySub = MySubtitle(self.MySub.sub.start_times,
+                                self.MySub.sub.end_times,
+                                self.srt_text(self.MySub.sub.subtitles))
 
     def __repr__(self):
         s = '%d:%d:<%s>' % (self.MySub.sub.start_times,
@@ -145,70 +174,69 @@ class SMI2SRT(smiItem):
     smi: smi file including .smi extension to be converted to srt format
     encoding: encoding for srt file to be saved
     titles: srt file contents in UTF-8 even though srt file to be written
-              might have the different encoding
+              might have the different encoding; built from mySubs on
+              first use
+    mySubs: CueTable of the converted subtitles
+    class_subs: CueTable of every <P Class=...>, see convert_smi_classes
     convereted: status of conversion
+    encoding_cache: EncodingCache or JSON file path caching detected
+                    encodings
+    profiler: StageProfiler recording the stages of the conversion, see
+              profiling.py
     '''
-    def __init__(self, smi, encoding):
+    def __init__(self, smi, encoding, encoding_cache=None, profiler=None):
         self.smifile = smi
         self.encoding = encoding
-        self.titles = []
+        # SRT lines of mySubs, see titles
+        self._titles = None
         self.converted = False
         self.srtfile = ""
         rndx = self.smifile.rfind('.')
         self.srtfile = '%s.srt' % self.smifile[0:rndx]
-        self.mySubs = list()
+        # cues of the smi file, see convert_smi
+        self.mySubs = CueTable()
+        self.class_subs = OrderedDict()
         self.return_srt = list()
+        self.encoding_cache = as_cache(encoding_cache)
+        self.profiler = as_profiler(profiler)
+
+    @property
+    def titles(self):
+        ''' list of the SRT lines of mySubs: number, timing and text lines
+        of every cue, as analysis_srt reads them '''
+        if self._titles is None:
+            timings = format_timings(self.mySubs.starts, self.mySubs.ends)
+            lines = []
+            for i, timing in enumerate(timings):
+                mystr = str(i + 1) + '\n' + timing + '\n' + \
+                    self.mySubs.text(i)
+                lines.extend(mystr.strip().split('\n'))
+            self._titles = lines
+        return self._titles
 
-    def _del_rows(self, indices):
-        for i in sorted(indices, reverse=True):
-            del self.mySubs[i]
+    @staticmethod
+    def _tokenize(smi_sgml, pos=0):
+        ''' yield (start, end, contents) of every SYNC block of a decoded
+        smi document, in one pass over the document.
 
-    def convert_smi(self, srtfile="", outside=False):
-        ''' convert smi file to srt format with encoding provided.
-        Default srt file name is same as smi except extention which is .srt
-        return True or Flase
+        contents are the raw text between a SYNC tag and the next one with
+        line breaks and the indentation following them removed.
         '''
-        if not self.smifile.lower().endswith('.smi'):
-            logger.error("Not smi file:".format(self.smifile))
-            return False
-
-        if not os.path.exists(self.smifile):
-            logger.error('Cannot find smi file {0}\n'.format(self.smifile))
-            return False
-
-        if srtfile == "":
-            rndx = self.smifile.rfind('.')
-            self.srtfile = '%s.srt' % self.smifile[0:rndx]
-        else:
-            self.srtfile = srtfile
-
-        with open(self.smifile, mode="rb") as ifp:
-            smi_sgml = ifp.read()
-
-        chdt = detector.detect(smi_sgml)
-        logger.info("{0} encoding is {1} with condidence {2}".
-                    format(self.smifile, chdt['encoding'], chdt['confidence']))
-        if chdt['encoding'].lower() != 'utf-8':
-            try:
-                # smi_sgml with chdt['encoding'] --convert--> unicode
-                smi_sgml = str(smi_sgml, chdt['encoding'].lower())
-            except UnicodeError:
-                logger.error("Error : str(smi_sgml, chdt) in {0}".
-                             format(self.smifile))
-                return False
-
-        # skip to first starting tag (skip first 0xff 0xfe ...)
-        try:
-            fndx = smi_sgml.find('<SYNC')
-        except Exception as e:
-            logger.debug(chdt)
-            raise e
-        if fndx < 0:
-            logger.error("No <SYNC string found, maybe it is not smi file")
-            return False
-        smi_sgml = smi_sgml[fndx:]
-        lines = smi_sgml.split('\n')
+        previous = None
+        for m in SYNC_RE.finditer(smi_sgml, pos):
+            if previous is not None:
+                contents = smi_sgml[previous.end():m.start()]
+                if '\n' in contents:
+                    contents = CONTINUATION_RE.sub('', contents)
+                yield int(previous.group(1)), int(m.group(1)), contents
+            previous = m
 
+    @staticmethod
+    def _tokenize_lines(smi_sgml, pos=0, encoding='utf-8'):
+        ''' line by line tokenizer _tokenize replaced; it only finds one
+        SYNC per line. Kept to benchmark and diff the two (see bench_smi.py)
+        '''
+        lines = smi_sgml[pos:].split('\n')
         sync_cont = ''
         next_start = None
         curr_start = None
@@ -216,7 +244,7 @@ class SMI2SRT(smiItem):
 
             # http://stackoverflow.com/questions/11339955/python-string-encode-decode
             # convert smi contents to utf-8 for re
-            if chdt['encoding'].lower() != 'utf-8':
+            if encoding.lower() != 'utf-8':
                 line = line.encode('UTF-8').decode('UTF-8')
             sndx = line.upper().find('<SYNC')
             if sndx >= 0:
@@ -229,44 +257,219 @@ class SMI2SRT(smiItem):
                 sync_cont += line[0:sndx]
                 curr_start = next_start
                 if not(curr_start is None):
-                    curr_end = int(m.group(1))
-                    curr_line = sync_cont
-                    curr_sub = smiItem()
-                    curr_sub.MySub = MySubtitle(curr_start,
-                                                curr_end, curr_line)
-                    self.mySubs.append(curr_sub)
+                    yield curr_start, int(m.group(1)), sync_cont
                 sync_cont = m.group(2)
                 next_start = int(m.group(1))
             else:
                 line = line.lstrip()
                 sync_cont += line
-        sub_index = 1
-        remove_rows = []
-        for i in range(len(self.mySubs)):
-            current_sub = self.mySubs[i]
-            current_sub.convertSrt()
-            if (current_sub.MySub.sub.subtitles is None or
-                len(current_sub.MySub.sub.subtitles) <= 0):
-                remove_rows.append(i)
-                continue
-            else:
-                mystr = str(sub_index) + '\n' + current_sub.MySub.timestamp() + '\n' + current_sub.MySub.data() + "\n"
-                for s in mystr.strip().split('\n'):
-                    self.titles.append(s)
-                sub_index += 1
-        self._del_rows(remove_rows)
+
+    @staticmethod
+    def _split_classes(contents):
+        ''' [(class, contents), ...] of the <P Class=...> paragraphs of the
+        contents of a SYNC block; class names are upper-cased and text
+        outside any classed paragraph belongs to class None
+        '''
+        parts = P_CLASS_RE.split(contents)
+        paragraphs = [(None, parts[0])] if parts[0].strip() else []
+        for i in range(1, len(parts), 2):
+            paragraphs.append((parts[i].upper(), parts[i+1]))
+        return paragraphs
+
+    @staticmethod
+    def _tokenize_mapped(smi_bytes, encoding, pos=0):
+        ''' _tokenize over the raw bytes of a smi document in a
+        byte_parsable encoding (see mapped_input.py); only the contents of
+        each SYNC block are decoded, one block at a time
+        '''
+        previous = None
+        for m in SYNC_BYTES_RE.finditer(smi_bytes, pos):
+            if previous is not None:
+                contents = smi_bytes[previous.end():m.start()].decode(
+                    encoding)
+                if '\n' in contents:
+                    contents = CONTINUATION_RE.sub('', contents)
+                yield int(previous.group(1)), int(m.group(1)), contents
+            previous = m
+
+    def _mapped_rows(self, ifp, smi_map, encoding, pos):
+        # SYNC blocks of a mapped smi file, which is closed once they are
+        # all read
+        try:
+            for row in self._tokenize_mapped(smi_map, encoding, pos):
+                yield row
+            self.profiler.count('smi_read', bytes_read=len(smi_map))
+        finally:
+            smi_map.close()
+            ifp.close()
+
+    def _smi_rows(self, srtfile=""):
+        ''' iterator of the (start, end, contents) SYNC blocks of the smi
+        file, or None when it cannot be read.
+
+        The file is memory-mapped and, when its encoding allows it, parsed
+        straight from the map with every block decoded on its own; the
+        iterator may then raise UnicodeError. Other files are read and
+        decoded as a whole.
+        '''
+        if not self.smifile.lower().endswith('.smi'):
+            logger.error("Not smi file:".format(self.smifile))
+            return None
+
+        if not os.path.exists(self.smifile):
+            logger.error('Cannot find smi file {0}\n'.format(self.smifile))
+            return None
+
+        if srtfile == "":
+            rndx = self.smifile.rfind('.')
+            self.srtfile = '%s.srt' % self.smifile[0:rndx]
+        else:
+            self.srtfile = srtfile
+
+        profiler = self.profiler
+        ifp = open(self.smifile, mode="rb")
+        smi_map = map_file(ifp)
+        try:
+            # detection reads a sample (and a hash) of the map only
+            with profiler.stage('detect'):
+                chdt = self.encoding_cache.detect(
+                    self.smifile, fallback=False,
+                    file=ifp if smi_map is None else smi_map)
+
+            logger.info("{0} encoding is {1} with condidence {2}".
+                        format(self.smifile, chdt['encoding'],
+                               chdt['confidence']))
+            if chdt['encoding'] is None:
+                chdt['encoding'] = 'utf-8'
+            encoding = chdt['encoding'].lower()
+
+            if smi_map is not None and byte_parsable(encoding):
+                # skip to first starting tag (skip first 0xff 0xfe ...)
+                first_sync = SYNC_BYTES_RE.search(smi_map)
+                if first_sync is None:
+                    logger.error("No <SYNC string found, maybe it is not "
+                                 "smi file")
+                    return None
+                rows = self._mapped_rows(ifp, smi_map, encoding,
+                                         first_sync.start())
+                # closed by rows from now on
+                ifp = smi_map = None
+                return rows
+
+            with profiler.stage('smi_read'):
+                ifp.seek(0)
+                smi_sgml = ifp.read()
+            profiler.count('smi_read', bytes_read=len(smi_sgml))
+        finally:
+            if smi_map is not None:
+                smi_map.close()
+            if ifp is not None:
+                ifp.close()
+
+        try:
+            # smi_sgml with chdt['encoding'] --convert--> unicode
+            with profiler.stage('decode'):
+                smi_sgml = str(smi_sgml, encoding)
+        except UnicodeError:
+            logger.error("Error : str(smi_sgml, chdt) in {0}".
+                         format(self.smifile))
+            return None
+
+        # skip to first starting tag (skip first 0xff 0xfe ...)
+        first_sync = SYNC_RE.search(smi_sgml)
+        if first_sync is None:
+            logger.error("No <SYNC string found, maybe it is not smi file")
+            return None
+        return self._tokenize(smi_sgml, first_sync.start())
+
+    def _batches(self, rows):
+        # lists of up to CLEAN_BATCH rows
+        rows = iter(rows)
+        while True:
+            with self.profiler.stage('smi_tokenize'):
+                batch = list(islice(rows, CLEAN_BATCH))
+            if not batch:
+                return
+            yield batch
+
+    @profiled('convert_smi')
+    def convert_smi_classes(self, classes=None):
+        ''' demultiplex the smi file by <P Class=...> in a single parse.
+
+        Returns an OrderedDict of class name (upper-cased, None for text
+        outside any classed paragraph) to the CueTable of that class, in
+        order of first appearance; only the given classes are kept if
+        classes is not None. Returns None if the file cannot be read.
+        '''
+        rows = self._smi_rows()
+        if rows is None:
+            return None
+        if classes is not None:
+            classes = set(c.upper() if c is not None else c for c in classes)
+
+        tables = OrderedDict()
+        try:
+            for batch in self._batches(rows):
+                paragraphs = []
+                with self.profiler.stage('smi_tokenize'):
+                    for start, end, contents in batch:
+                        for name, text in self._split_classes(contents):
+                            if classes is None or name in classes:
+                                paragraphs.append((name, start, end, text))
+                # every class of the batch is cleaned at once
+                with self.profiler.stage('smi_clean'):
+                    texts = smiItem.srt_texts([p[3] for p in paragraphs])
+                for (name, start, end, _), text in zip(paragraphs, texts):
+                    if name not in tables:
+                        tables[name] = CueTable()
+                    if text:
+                        tables[name].append(start, end, text)
+        except UnicodeError:
+            logger.error("Error : str(smi_sgml, chdt) in {0}".
+                         format(self.smifile))
+            return None
+        tables = OrderedDict((name, tables[name]) for name in tables
+                             if len(tables[name]) > 0)
+        self.class_subs = tables
+        self.profiler.count('convert_smi', cues=sum(len(tables[name])
+                                                    for name in tables))
+        return tables
+
+    @profiled('convert_smi')
+    def convert_smi(self, srtfile="", outside=False):
+        ''' convert smi file to srt format with encoding provided.
+        Default srt file name is same as smi except extention which is .srt
+        return True or Flase
+        '''
+        rows = self._smi_rows(srtfile)
+        if rows is None:
+            return False
+
+        # SYNC blocks are cleaned a batch at a time as they are read, so
+        # their raw contents are never all held at once; the empty ones,
+        # such as the &nbsp; SYNCs clearing the screen, are dropped there
+        self.mySubs = CueTable()
+        self._titles = None
+        try:
+            for batch in self._batches(rows):
+                with self.profiler.stage('smi_clean'):
+                    texts = smiItem.srt_texts([row[2] for row in batch])
+                for (curr_start, curr_end, _), text in zip(batch, texts):
+                    if text:
+                        self.mySubs.append(curr_start, curr_end, text)
+        except UnicodeError:
+            logger.error("Error : str(smi_sgml, chdt) in {0}".
+                         format(self.smifile))
+            return False
+        self.profiler.count('convert_smi', cues=len(self.mySubs))
         if outside is True:
             return(self.mySubs)
 
     def _print_srt(self):
         # open file with required encoding
-        with io.open(self.srtfile, mode='w', encoding=self.encoding) as writer:
-            for i in range(len(self.mySubs)):
-                current = self.mySubs[i].MySub
-                line = str(i+1) + '\n' + current.timestamp() + '\n' + current.data() + "\n\n"
-                if(i == len(self.mySubs)-1):
-                    line = line[:-2]
-                writer.write(line)
+        with io.open(self.srtfile, mode='wb') as stream:
+            with SRTWriter(stream, self.encoding) as writer:
+                writer.write_all(self.mySubs)
 
             logger.info("Written file {0} in {1}".
                         format(self.srtfile, self.encoding))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming SRT reader.
+
+iter_srt reads an SRT file piece by piece and yields a MySubtitle for every
+dialog as soon as its block is complete, so only the cue being parsed is
+kept in memory whatever the size of the file. read_srt stores the same
+dialogs straight into a CueTable. Timing lines are parsed in batches of
+BATCH_SIZE dialogs with timecodes.parse_timings.
+"""
+import codecs
+
+from my_subtitle import MySubtitle
+from cue_table import CueTable
+from timecodes import timestamp_to_ms, parse_timings
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 512
+
+
+def _chunks(source, chunk_size):
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def iter_lines(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield the lines of source without their line ending.
+
+    source is a binary or text file object, or an iterable of bytes/str
+    chunks. Bytes are decoded incrementally with encoding.
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in _chunks(source, chunk_size):
+        if not isinstance(chunk, str):
+            chunk = decoder.decode(chunk)
+        if not chunk:
+            continue
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.endswith('\r'):
+                line = line[:-1]
+            yield line
+    pending += decoder.decode(b'', final=True)
+    if pending.endswith('\r'):
+        pending = pending[:-1]
+    if pending:
+        yield pending
+
+
+def _parse_block(block):
+    # block is [number, timing, text lines...]; returns a (start, end, text)
+    # row or None for blocks that are not a dialog
+    if len(block) < 3:
+        return None
+    timing = block[1].split('-->')
+    if len(timing) != 2:
+        return None
+    try:
+        start_time = timestamp_to_ms(timing[0].strip())
+        end_time = timestamp_to_ms(timing[1].strip())
+    except ValueError as e:
+        raise ValueError('%s in subtitle number %s' % (e, block[0].strip()))
+    text = '\n'.join([line.lstrip() for line in block[2:]]).strip('\n')
+    if text == '':
+        return None
+    return start_time, end_time, text
+
+
+def _parse_blocks(blocks):
+    # rows of a batch of blocks; the timing lines of the whole batch are
+    # parsed at once, and a batch holding a timing line parse_timings does
+    # not understand is parsed again block by block
+    starts, ends = parse_timings('\n'.join([block[1] for block in blocks]))
+    if len(starts) != len(blocks):
+        return [row for row in map(_parse_block, blocks) if row is not None]
+    rows = []
+    for i in range(len(blocks)):
+        text = '\n'.join([line.lstrip() for line in blocks[i][2:]])
+        text = text.strip('\n')
+        if text != '':
+            rows.append((starts[i], ends[i], text))
+    return rows
+
+
+def iter_srt_rows(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield a (start, end, text) row for every dialog of an SRT source.
+
+    Blocks that are not dialogs (no timing line, no text) are skipped. A
+    timing line that is not HH:MM:SS,mmm --> HH:MM:SS,mmm raises
+    ValueError.
+    '''
+    blocks = []
+    block = []
+    for line in iter_lines(source, encoding, chunk_size):
+        if line.strip() != '':
+            block.append(line)
+            continue
+        # blocks shorter than number, timing and text are not dialogs
+        if len(block) >= 3:
+            blocks.append(block)
+            if len(blocks) >= BATCH_SIZE:
+                for row in _parse_blocks(blocks):
+                    yield row
+                blocks = []
+        block = []
+    if len(block) >= 3:
+        blocks.append(block)
+    if blocks:
+        for row in _parse_blocks(blocks):
+            yield row
+
+
+def iter_srt(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield a MySubtitle for every dialog of an SRT source '''
+    for start_time, end_time, text in iter_srt_rows(source, encoding,
+                                                    chunk_size):
+        yield MySubtitle(start_time, end_time, text)
+
+
+def read_srt(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' CueTable of every dialog of an SRT source '''
+    return CueTable(iter_srt_rows(source, encoding, chunk_size))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming SRT writer.
+
+SRTWriter encodes every cue as soon as it is written and pushes it through
+a buffered binary stream, so a merged file never has to be held in memory
+as a list of encoded lines. The blank line between two dialogs is written
+in front of the next dialog rather than after the current one, so the
+file ends right after the text of the last dialog without having to go
+back and trim it.
+
+The other output formats (subtitle_writers) subclass SRTWriter and only
+change how the file begins and ends and how a batch of cues is formatted.
+"""
+import codecs
+import io
+import sys
+
+from cue_table import CueTable
+from timecodes import format_timings
+
+# cues of a CueTable formatted per call to format_timings
+BATCH_SIZE = 4096
+
+
+def open_output(output):
+    ''' binary stream for output: '-' for stdout, a path, or a file object.
+
+    Only the stream opened for a path belongs to the caller to close.
+    '''
+    if output == '-':
+        output = sys.stdout
+    if hasattr(output, 'write'):
+        if hasattr(output, 'buffer'):
+            # text streams such as sys.stdout write their bytes to .buffer,
+            # after what was printed to them already
+            output.flush()
+            return output.buffer
+        return output
+    return io.open(output, 'wb')
+
+
+class SRTWriter(object):
+    '''
+    Write MySubtitle cues to a binary stream in SRT format.
+
+    stream: binary file object; it is wrapped in an io.BufferedWriter when
+            it is not buffered already
+    encoding: encoding of the written subtitles
+    '''
+    def __init__(self, stream, encoding='utf-8'):
+        # the wrapper of an unbuffered stream, detached from it on close
+        self._wrapper = None
+        if isinstance(stream, io.RawIOBase):
+            stream = self._wrapper = io.BufferedWriter(stream)
+        self.stream = stream
+        self.encoding = encoding
+        self._encoder = codecs.getincrementalencoder(encoding)()
+        self.count = 0
+        self.bytes_written = 0
+        self._started = False
+
+    def _emit(self, text, final=False):
+        data = self._encoder.encode(text, final)
+        if data:
+            self.stream.write(data)
+            self.bytes_written += len(data)
+
+    def _begin(self):
+        # text of the file before its first cue
+        return ''
+
+    def _end(self):
+        # text of the file after its last cue
+        return ''
+
+    def _timings(self, starts, ends):
+        # timing strings of two columns of ms values
+        return format_timings(starts, ends)
+
+    def _cue(self, parts, start, end, timing, text):
+        # appends the text of one cue to parts
+        if self.count > 0:
+            parts.append('\n\n')
+        self.count += 1
+        parts.append(str(self.count) + '\n' + timing + '\n' + text)
+
+    def _write_rows(self, starts, ends, texts):
+        if not self._started:
+            self._started = True
+            self._emit(self._begin())
+        parts = []
+        for start, end, timing, text in zip(starts, ends,
+                                            self._timings(starts, ends),
+                                            texts):
+            self._cue(parts, start, end, timing, text)
+        self._emit(''.join(parts))
+
+    def write(self, cue):
+        self._write_rows([cue.start()], [cue.end()], [cue.data()])
+
+    def write_all(self, cues):
+        if not isinstance(cues, CueTable):
+            for cue in cues:
+                self.write(cue)
+            return
+        # straight from the columns, timings formatted a batch at a time
+        for first in range(0, len(cues), BATCH_SIZE):
+            last = min(first + BATCH_SIZE, len(cues))
+            self._write_rows(cues.starts[first:last], cues.ends[first:last],
+                             [cues.text(i) for i in range(first, last)])
+
+    def close(self):
+        ''' flush pending bytes; the underlying stream is left open '''
+        if not self._started:
+            self._started = True
+            self._emit(self._begin())
+        self._emit(self._end(), final=True)
+        self.stream.flush()
+        if self._wrapper is not None:
+            # a collected BufferedWriter closes the stream it wraps
+            self.stream = self._wrapper.detach()
+            self._wrapper = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -2,28 +2,34 @@
 # author: Christopher Slycord
 
 from __future__ import print_function
-import re
 import sys
 import os
+import math
+from collections import OrderedDict
 from my_subtitle import MySubtitle
-from smi2srt import SMI2SRT
-try:
-    import cchardet
-except ImportError:
-    print('''cchardet python package not found. Please install it using
-macports or pip''')
-    sys.exit()
-try:
-    import chardet
-except ImportError:
-    print('''chardet python package not found. Please install it using
-macports or pip''')
-    sys.exit()
-
+from merge_engine import sweep_merge
+from cue_table import CueTable
+from interval_index import IntervalIndex
+from subtitle_readers import DESCRIPTIONS, EXTENSIONS, READERS, \
+    track_format
+from timecodes import ms_to_timestamp, timestamp_to_ms
+from encoding_detect import as_cache
+from track_cache import as_track_cache
+from profiling import as_profiler, profiled
+from time_transform import TimeTransform, parse_time
+from srt_writer import open_output
+from subtitle_writers import ASSWriter, WRITERS, format_for
 TIME_PATTERN = (r'\d{1,2}:\d{1,2}:\d{1,2},\d{1,5} --> '
                 r'\d{1,2}:\d{1,2}:\d{1,2},\d{1,5}\r\n')
 
 
+def _spans(cues):
+    # (start, end) of every cue of a CueTable or a list of MySubtitle
+    if isinstance(cues, CueTable):
+        return zip(cues.starts, cues.ends)
+    return ((cue.start(), cue.end()) for cue in cues)
+
+
 class Merger():
     """
     SRT Merger allows you to merge subtitle files, no matter what language
@@ -32,15 +38,38 @@ class Merger():
     """
     def __init__(self,
                  output_file='subtitle_name.srt',
-                 output_encoding='utf-8'):
-        self.lines = []
+                 output_encoding='utf-8',
+                 legacy_merge=False,
+                 encoding_cache=None,
+                 track_cache=None,
+                 profile=False,
+                 output_format=None):
         self.remove_rows = list()
         dirpath = os.path.dirname(output_file)
         self.output_path = dirpath if dirpath != '' else '.'
         self.output_name = os.path.basename(output_file)
         self.output_encoding = output_encoding
-        # self.subtitles will be a list of all subs
-        self.subtitles = list()
+        # srt, vtt, ass or smi; by default from the output_file extension
+        self.output_format = output_format or format_for(output_file)
+        # legacy_merge inserts cues one by one through _check_times instead
+        # of using the sweep-line engine; kept around to diff both outputs
+        self.legacy_merge = legacy_merge
+        # self.subtitles will be a CueTable of all subs (with legacy_merge,
+        # an IntervalIndex of MySubtitle, which is its own index)
+        self.subtitles = IntervalIndex() if legacy_merge else CueTable()
+        # the CueTables merged into self.subtitles, from top to bottom; ASS
+        # output gives each one its own style
+        self.tracks = list()
+        # detected input encodings, optionally saved to a JSON file
+        self.encoding_cache = as_cache(encoding_cache)
+        # parsed input tracks kept on disk between runs (TrackCache or a
+        # directory), None to always parse
+        self.track_cache = as_track_cache(track_cache)
+        # per-stage timings and counters when profile is True (or a
+        # StageProfiler), see profile_report()
+        self.profiler = as_profiler(profile)
+        # interval index over the self.subtitles CueTable, built on first use
+        self._index = None
 
     def get_milliseconds(self, timestr, File, SubNumber):
         if len(timestr) != 12:
@@ -48,75 +77,47 @@ class Merger():
             print("Have a look at subtitle number " + str(SubNumber))
             print("Exiting!")
             sys.exit(1)
-        HRS = int(timestr[0:2])
-        MINS = int(timestr[3:5])
-        SECS = int(timestr[6:8])
-        MIL_SECS = int(timestr[9:12])
+        return timestamp_to_ms(timestr)
 
-        HRS_MS = int(3600000)
-        MINS_MS = int(60000)
-        SECS_MS = int(1000)
-
-        return(HRS*HRS_MS+MINS*MINS_MS+SECS*SECS_MS+MIL_SECS)
+    def _get_index(self):
+        if isinstance(self.subtitles, IntervalIndex):
+            return self.subtitles
+        if self._index is None or len(self._index) != len(self.subtitles):
+            self._index = IntervalIndex(self.subtitles)
+        return self._index
 
     def _findOverlapping(self, CheckSubtitle):
-        # returns the maximum position in the list of timestamps that are lower
-        # than the one we are checking. Avoids needless looping
-
-        first = 0
-        last = len(self.subtitles)-1
-
-        if (last < first):
-            return first
-        if CheckSubtitle <= self.subtitles[first]:
-            return first
-        if CheckSubtitle >= self.subtitles[last]:
-            return last
-
-        def do_search(Subtitle, low, high):
-            if Subtitle >= self.subtitles[high]:
-                return high
-            if Subtitle <= self.subtitles[low]:
-                return low
-            if low >= high:
-                return high
-            middle = (low + high) // 2
-            middle_sub = self.subtitles[middle]
-            if middle_sub == Subtitle:
-                return middle
-            if middle_sub > Subtitle:
-                return do_search(Subtitle, low, middle)
-            return do_search(Subtitle, middle+1, high)
-
-        position = do_search(CheckSubtitle, first, last)
-        # position now has the position in the list that has the next highest
-        # start time.
-        # But the new subtitle to be inserted might start before the previous
-        # subtitle ended
-        keep_looking = True
-        while position != first and keep_looking:
-            if CheckSubtitle.start() < self.subtitles[position-1].end():
-                position -= 1
-            else:
-                keep_looking = False
-        return position
+        # returns the position of the first subtitle still on screen when
+        # CheckSubtitle starts, or the last position if all of them ended
+        if len(self.subtitles) == 0:
+            return 0
+        position = self._get_index().first_ending_after(
+            CheckSubtitle.start())
+        return min(position, len(self.subtitles)-1)
 
     def _add_lines(self, ListOfLines, position, remove=True):
-        end = len(self.subtitles)
-
-        if position > end:
-            self.subtitles += ListOfLines
-        else:
-            if not remove:
-                if position == end:
-                    self.subtitles += ListOfLines
-                else:
-                    self.subtitles = self.subtitles[0:position] + \
-                        ListOfLines + self.subtitles[position:]
-            else:
-                self.subtitles = self.subtitles[0:position] + \
-                    ListOfLines + self.subtitles[position+1:]
-
+        # the subtitles are the nodes of the index, so replacing one is a
+        # few O(log n) removals and inserts
+        subtitles = self.subtitles
+        end = len(subtitles)
+
+        if position >= end:
+            position = end
+            remove = False
+        if remove:
+            subtitles.pop(position)
+        for offset in range(len(ListOfLines)):
+            subtitles.insert(position + offset, ListOfLines[offset])
+
+    def on_screen(self, time_ms):
+        """ merged subtitles displayed at time_ms """
+        return self._get_index().at(time_ms)
+
+    def overlapping(self, start_ms, end_ms):
+        """ merged subtitles displayed anywhere in [start_ms, end_ms) """
+        return self._get_index().overlapping(start_ms, end_ms)
+
+    @profiled('check_times')
     def _check_times(self,
                      CheckSubtitle,
                      SubNumber,
@@ -341,44 +342,28 @@ class Merger():
 
                 self._add_lines(added_rows, len(self.subtitles), remove=False)
 
-    def _split_dialogs(self,
-                       dialogs,
-                       subtitle,
-                       FirstFile=True):
-        for dialog in dialogs:
-            if dialog.startswith('\r\n'):
-                dialog = dialog.replace('\r\n', '', 1)
-            if dialog.startswith('\n'):
-                dialog = dialog[1:]
-            if (
-                    dialog == '' or
-                    dialog == '\n' or
-                    dialog.rstrip().lstrip() == ''):
-                continue
-            try:
-                if dialog.startswith('\r\n'):
-                    dialog = dialog[2:]
-                SubNumber = dialog.split('\n', 2)[0]
-                StartTime = dialog.split('\n', 2)[1].split('-->')[0].rstrip()
-                StartTime = int(self.get_milliseconds(StartTime,
-                                                      subtitle['address'],
-                                                      SubNumber))
-                EndTime = dialog.split('\n', 2)[1].split('-->')[1].lstrip()
-                EndTime = int(self.get_milliseconds(EndTime,
-                                                    subtitle['address'],
-                                                    SubNumber))
-            except Exception as e:
-                continue
-            texts = dialog.split('\n', 1)[1].split('\n')[1:]
-            Text = ""
-            for t in texts:
-                t = t.lstrip()
-                Text += t + '\n'
-            if Text == '' or Text == '\n':
-                continue
-            Text = Text.strip('\n')
-            sub = MySubtitle(StartTime, EndTime, Text)
-            self._check_times(sub, SubNumber, FirstFile)
+    @profiled('split_dialogs')
+    def _split_dialogs(self, stream, subtitle):
+        # parses the dialogs of an opened SRT, WebVTT or ASS file into a
+        # CueTable
+        try:
+            cues = READERS[subtitle['format']](stream, subtitle['encoding'])
+            self.profiler.count('split_dialogs', cues=len(cues),
+                                bytes_read=stream.tell())
+            return cues
+        except UnicodeError as e:
+            # a ValueError too, but the timecodes are not to blame
+            print(subtitle['address'] + " could not be decoded as " +
+                  subtitle['encoding'] + ".")
+            print(str(e))
+            print("Exiting!")
+            sys.exit(1)
+        except ValueError as e:
+            print(subtitle['address'] + " has an invalid timecode for " +
+                  DESCRIPTIONS[subtitle['format']] + " file.")
+            print(str(e))
+            print("Exiting!")
+            sys.exit(1)
 
     def _encode(self, text):
         codec = self.output_encoding
@@ -390,70 +375,251 @@ class Merger():
             return (b'An error has been occured in encoing by specifed '
                     b'`output_encoding`')
 
-    def add(self, top_subtitle_address, bottom_subtitle_address):
-        windows_line_ending = '\r\n'
-        linux_line_ending = '\n'
-
-        top_subtitle = {
-            'address': top_subtitle_address,
-            'dialogs': []
+    @staticmethod
+    def split_class(subtitle_address):
+        """ (path, class) of a "movie.smi#CLASS" address selecting one
+        <P Class=...> of a multi-language SMI file; class is None for any
+        other address """
+        path, sep, name = subtitle_address.rpartition('#')
+        if sep and path.lower().endswith('.smi') and \
+                not os.path.exists(subtitle_address):
+            return path, name.upper()
+        return subtitle_address, None
+
+    def _parse(self, path, kind, parse):
+        # OrderedDict of tables parse() returns for path, from the track
+        # cache when it has them
+        if self.track_cache is None:
+            return parse()
+        with open(path, 'rb') as file:
+            return self.track_cache.cached(file, kind, parse)
+
+    def _read_smi_classes(self, path):
+        def parse():
+            # smi2srt is only loaded for SMI files missing from the cache
+            from smi2srt import SMI2SRT
+            SMI = SMI2SRT(smi=path,
+                          encoding=self.output_encoding,
+                          encoding_cache=self.encoding_cache,
+                          profiler=self.profiler)
+            return SMI.convert_smi_classes()
+        tables = self._parse(path, 'smi-classes', parse)
+        if tables is None:
+            print(path + " could not be read as an SMI file.")
+            print("Exiting!")
+            sys.exit(1)
+        return tables
+
+    def _read_smi(self, subtitle_address):
+        def parse():
+            from smi2srt import SMI2SRT
+            SMI = SMI2SRT(smi=subtitle_address,
+                          encoding=self.output_encoding,
+                          encoding_cache=self.encoding_cache,
+                          profiler=self.profiler)
+            cues = SMI.convert_smi(outside=True)
+            return None if cues is False else OrderedDict([(None, cues)])
+        tables = self._parse(subtitle_address, 'smi', parse)
+        if tables is None:
+            print(subtitle_address + " could not be read as an SMI file.")
+            print("Exiting!")
+            sys.exit(1)
+        return tables[None]
+
+    def _track_format(self, path):
+        # srt, smi, vtt or ass: from the extension of path, else sniffed
+        # from its content
+        fmt = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if fmt is not None:
+            return fmt
+        with open(path, 'rb') as file:
+            with self.profiler.stage('detect'):
+                chdt = self.encoding_cache.detect(path, file=file)
+            return track_format(path, chdt['encoding'], file)
+
+    def _read_srt(self, subtitle_address, fmt='srt'):
+        subtitle = {
+            'address': subtitle_address,
+            'encoding': None,
+            'format': fmt
             }
-        bottom_subtitle = {
-                'address': bottom_subtitle_address,
-                'dialogs': []
-                }
-        if top_subtitle_address.lower().endswith('.smi'):
-            SMI = SMI2SRT(smi=top_subtitle_address,
-                          encoding=self.output_encoding)
-            converted_smi = SMI.convert_smi(outside=True)
-            for i in range(len(converted_smi)):
-                self._check_times(converted_smi[i].MySub, i+1, FirstFile=True)
-            # self._add_lines(SMI.convert_smi(outside=True),
-            #                 len(self.subtitles),
-            #                 remove=False)
-            # easy_srt = SMI.analysis_srt()
+        with open(subtitle_address, 'rb') as file:
+            with self.profiler.stage('detect'):
+                chdt = self.encoding_cache.detect(subtitle_address, file=file)
+            subtitle['encoding'] = chdt['encoding'] or 'utf-8'
+            return self._split_dialogs(file, subtitle)
+
+    def _read_track(self, subtitle_address, smi_classes=None):
+        # returns a CueTable of one subtitle file, in file order;
+        # smi_classes caches the classes of SMI files parsed already
+        path, name = self.split_class(subtitle_address)
+        if name is not None:
+            if smi_classes is None:
+                smi_classes = dict()
+            if path not in smi_classes:
+                smi_classes[path] = self._read_smi_classes(path)
+            if name not in smi_classes[path]:
+                print(path + " has no " + name + " class. Classes found: " +
+                      ', '.join(str(c) for c in smi_classes[path]))
+                print("Exiting!")
+                sys.exit(1)
+            return smi_classes[path][name]
+
+        fmt = self._track_format(subtitle_address)
+        if fmt == 'smi':
+            return self._read_smi(subtitle_address)
+        return self._parse(
+            subtitle_address, fmt,
+            lambda: OrderedDict([(None, self._read_srt(subtitle_address,
+                                                       fmt))])
+            )[None]
+
+    def _transform(self, track, transform):
+        # track retimed by a TimeTransform, if any
+        if transform is None or transform.is_identity():
+            return track
+        with self.profiler.stage('transform'):
+            return transform.apply(track)
+
+    @profiled('add')
+    def add_tracks(self, subtitle_addresses, order=None, transforms=None):
+        """ Merge any number of subtitle files in a single pass.
+
+        subtitle_addresses are stacked from top to bottom in the given
+        order, unless order lists the indices of subtitle_addresses from
+        top to bottom. "movie.smi#KRCC" selects the KRCC class of a
+        multi-language SMI file; every class of the same file comes from
+        a single parse of it. transforms lists a TimeTransform (or None)
+        per subtitle address, applied to the time columns of its cues as
+        soon as they are parsed.
+        """
+        if order is None:
+            order = range(len(subtitle_addresses))
+        if transforms is None:
+            transforms = [None] * len(subtitle_addresses)
+        smi_classes = dict()
+        tracks = [self._transform(self._read_track(address, smi_classes),
+                                  transform)
+                  for address, transform in zip(subtitle_addresses,
+                                                transforms)]
+
+        cues_in = len(self.subtitles) + sum(len(track) for track in tracks)
+        if self.profiler.enabled:
+            spans_in = set(_spans(self.subtitles))
+            for track in tracks:
+                spans_in.update(_spans(track))
+        self.tracks = self.tracks + [tracks[index] for index in order]
+        if self.legacy_merge:
+            if not isinstance(self.subtitles, IntervalIndex):
+                self.subtitles = IntervalIndex(self.subtitles)
+            for index in order:
+                cues = tracks[index]
+                for i in range(len(cues)):
+                    self._check_times(cues[i], i+1, FirstFile=(index == 0))
         else:
-            with open(top_subtitle_address, 'rb') as file:
-                data = file.read()
-                cchdt = cchardet.detect(data)
-                codec = cchdt['encoding']
-                if cchdt['confidence'] < 0.99:
-                    chdt = chardet.detect(data)
-                    if chdt['confidence'] > cchdt['confidence']:
-                        codec = chdt['encoding']
-                data = data.decode(codec).replace(windows_line_ending,
-                                  linux_line_ending)
-                dialogs = re.split('\r\n\r|\n\n', data)
-                top_subtitle['data'] = data
-                top_subtitle['raw_dialogs'] = dialogs
-                self._split_dialogs(dialogs, top_subtitle,
-                                    FirstFile=True)
-
-        if bottom_subtitle_address.lower().endswith('.smi'):
-            SMI = SMI2SRT(smi=bottom_subtitle_address,
-                          encoding=self.output_encoding)
-            converted_smi = SMI.convert_smi(outside=True)
-            for i in range(len(converted_smi)):
-                self._check_times(converted_smi[i].MySub, i+1, FirstFile=False)
-            # self._add_lines(SMI.convert_smi(outside=True),
-            #                 len(self.subtitles),
-            #                remove=False)
+            # whatever was merged by a previous add() stays on top
+            tracks.insert(0, self.subtitles)
+            with self.profiler.stage('sweep_merge'):
+                self.subtitles = sweep_merge(tracks,
+                                             [0] + [i+1 for i in order])
+            self._index = None
+        if self.profiler.enabled:
+            # splits: merged cues cut out of overlapping ones, i.e. whose
+            # span is not the span of any cue merged
+            self.profiler.count(
+                'add', tracks=len(subtitle_addresses), cues=cues_in,
+                merged_cues=len(self.subtitles),
+                splits=sum(span not in spans_in
+                           for span in _spans(self.subtitles)))
+
+    def _window_track(self, subtitle_address, start_ms, end_ms):
+        # CueTable of the cues of one subtitle file shown in the window,
+        # in file order
+        from cue_index import CueIndex
+        path, name = self.split_class(subtitle_address)
+        if name is None and self._track_format(path) not in ('srt', 'smi'):
+            index = None
         else:
-            with open(bottom_subtitle_address, 'rb') as file:
-                data = file.read()
-                cchdt = cchardet.detect(data)
-                codec = cchdt['encoding']
-                if cchdt['confidence'] < 0.99:
-                    chdt = chardet.detect(data)
-                    if chdt['confidence'] > cchdt['confidence']:
-                        codec = chdt['encoding']
-                data = data.decode(codec).replace(windows_line_ending,
-                                  linux_line_ending)
-                bottom_dialogs = re.split('\r\n\r|\n\n', data)
-                bottom_subtitle['data'] = data
-                bottom_subtitle['raw_dialogs'] = bottom_dialogs
-                self._split_dialogs(bottom_dialogs, bottom_subtitle,
-                                    FirstFile=False)
+            try:
+                with self.profiler.stage('cue_index'):
+                    index = CueIndex.build(path, self.encoding_cache)
+            except UnicodeError as e:
+                print(path + " could not be decoded.")
+                print(str(e))
+                print("Exiting!")
+                sys.exit(1)
+            except ValueError as e:
+                print(path + " has an invalid timecode for an SRT file.")
+                print(str(e))
+                print("Exiting!")
+                sys.exit(1)
+        if index is not None and name is not None and \
+                name not in index.classes:
+            print(path + " has no " + name + " class. Classes found: " +
+                  ', '.join(index.classes))
+            print("Exiting!")
+            sys.exit(1)
+        if index is not None:
+            with self.profiler.stage('window_read'):
+                cues = index.window(start_ms, end_ms, name)
+            self.profiler.count('window_read', cues=len(cues))
+            return cues
+        # not indexable (UTF-16, ...): parse it all and keep the window
+        cues = self._read_track(subtitle_address)
+        return CueTable(row for row in cues.rows()
+                        if row[0] < end_ms and row[1] > start_ms)
+
+    @profiled('merge_window')
+    def merge_window(self, subtitle_addresses, start_ms, end_ms, order=None,
+                     transforms=None):
+        """ Merge only what subtitle_addresses show in [start_ms, end_ms).
+
+        Every file is read through a CueIndex, which seeks to the cues of
+        the window instead of parsing the whole file. The merged cues are
+        cut at the window bounds, so they are exactly the ones a full
+        merge shows inside the window. They replace self.subtitles and
+        are returned as a CueTable. transforms are the ones of add_tracks;
+        the window is in transformed time.
+        """
+        tracks = []
+        for i, address in enumerate(subtitle_addresses):
+            transform = transforms[i] if transforms else None
+            if transform is None:
+                tracks.append(self._window_track(address, start_ms, end_ms))
+                continue
+            # the source times shown in the window, with a margin for the
+            # rounding of transformed times
+            margin = int(math.ceil(1 / transform.scale)) + 1
+            track = self._window_track(
+                address,
+                int(math.floor(transform.inverse(start_ms))) - margin,
+                int(math.ceil(transform.inverse(end_ms))) + margin)
+            tracks.append(self._transform(track, transform))
+        if order is None:
+            order = range(len(tracks))
+        self.tracks = [
+            CueTable((max(start, start_ms), min(end, end_ms), text)
+                     for start, end, text in tracks[index].rows()
+                     if min(end, end_ms) > max(start, start_ms))
+            for index in order]
+        merged = CueTable()
+        for start, end, text in sweep_merge(tracks, order).rows():
+            start = max(start, start_ms)
+            end = min(end, end_ms)
+            if end > start:
+                merged.append(start, end, text)
+        self.subtitles = merged
+        self._index = None
+        return merged
+
+    def add(self, top_subtitle_address, bottom_subtitle_address):
+        self.add_tracks([top_subtitle_address, bottom_subtitle_address])
+
+    def add_smi_classes(self, smi_address, classes, order=None):
+        """ merge the given <P Class=...> of one SMI file, top to bottom,
+        from a single parse of it """
+        self.add_tracks(['%s#%s' % (smi_address, name) for name in classes],
+                        order)
 
     def get_output_path(self):
         if self.output_path.endswith('/'):
@@ -461,55 +627,210 @@ class Merger():
         return self.output_path + '/' + self.output_name
 
     def ms2TS(self, timeMS):
-        HRS_MS = int(3600000)
-        MINS_MS = int(60000)
-        SECS_MS = int(1000)
-
-        ms = timeMS
-
-        hours = ms // HRS_MS
-        ms -= hours * HRS_MS
-        minutes = ms // MINS_MS
-        ms -= minutes * MINS_MS
-        seconds = ms // SECS_MS
-        ms -= seconds * SECS_MS
-        s = '%02d:%02d:%02d,%03d' % (hours, minutes, seconds, ms)
-        return s
-
-    def _write(self):
-
-        self.lines = []
-        for i in range(len(self.subtitles)):
-                current = self.subtitles[i]
-                line = str(i+1) + '\n' + current.timestamp() + '\n' + \
-                current.data() + '\n\n'
-                if i == len(self.subtitles)-1:
-                    line = line[:-1]
-                line = line.encode(self.output_encoding)
-                self.lines.append(line)
-
-        if self.lines[-1].endswith(b'\x00\n\x00'):
-            self.lines[-1] = self.lines[-1][:-3] + b'\x00'
-        if self.lines[-1].endswith(b'\n'):
-            self.lines[-1] = self.lines[-1][:-1] + b''
-        import io
-        with io.open(self.get_output_path(), 'w',
-                     encoding=self.output_encoding) as output:
-            output.buffer.writelines(self.lines)
-            print("'%s'" % (output.name), 'created successfully.')
+        return ms_to_timestamp(timeMS)
+
+    def profile_report(self):
+        """ per-stage timings and counters, see profiling.StageProfiler """
+        return self.profiler.report()
+
+    @profiled('write')
+    def _write(self, output=None):
+        """ write the merged subtitles as self.output_format.
+
+        output is a path, a file object or '-' for stdout, and defaults to
+        the output_file given to the Merger ('-' also means stdout there).
+        """
+        if output is None:
+            output = self.get_output_path()
+            if self.output_name == '-' and self.output_path == '.':
+                output = '-'
+        stream = open_output(output)
+        try:
+            if self.output_format == 'ass' and len(self.tracks) > 1:
+                # one style per source track instead of the merged cues
+                with ASSWriter(stream, self.output_encoding,
+                               len(self.tracks)) as writer:
+                    for i, track in enumerate(self.tracks):
+                        writer.write_all(track, i)
+            else:
+                with WRITERS[self.output_format](
+                        stream, self.output_encoding) as writer:
+                    writer.write_all(self.subtitles)
+            self.profiler.count('write', cues=writer.count,
+                                bytes_written=writer.bytes_written)
+        finally:
+            # stdout and file objects given by the caller stay open
+            if not hasattr(output, 'write') and output != '-':
+                stream.close()
+        if isinstance(output, str) and output != '-':
+            print("'%s'" % (output), 'created successfully.')
 
 
 if __name__ == '__main__':
-    if (len(sys.argv) < 4) or (len(sys.argv) > 5):
-        print("Usage:")
-        print("$python srtmerger top_sub.srt bottom_sub.srt output.srt \
-              [output_encoding]")
+    import argparse
+    from track_cache import TrackCache, default_directory
+    parser = argparse.ArgumentParser(
+        description='Merge subtitle files into one SRT, WebVTT, ASS or '
+                    'SAMI file.',
+        usage='%(prog)s top_sub.srt bottom_sub.srt output.srt '
+              '[output_encoding]\n'
+              '       %(prog)s -o output.srt [-e ENCODING] [--order ORDER] '
+              'sub1 sub2 [sub3 ...]')
+    parser.add_argument('subtitles', nargs='+',
+                        help='subtitles (.srt/.smi/.vtt/.ass) from top to '
+                             'bottom; movie.smi#ENCC selects one class of '
+                             'a multi-language SMI file; without -o the last '
+                             'ones are the output file and an optional '
+                             'encoding')
+    parser.add_argument('-o', '--output',
+                        help='merged file to write, - for stdout; every '
+                             'positional argument is then an input track')
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        help='format of the merged file (default: from its '
+                             'extension, else srt); ass gives every input '
+                             'its own style')
+    parser.add_argument('-e', '--encoding', default=None,
+                        help='encoding of the merged file (default: utf-8)')
+    parser.add_argument('--order',
+                        help='comma separated input numbers (1-based) from '
+                             'top to bottom, e.g. 2,1,3')
+    parser.add_argument('--legacy-merge', action='store_true',
+                        help='merge cue by cue with the old insertion code')
+    parser.add_argument('--encoding-cache', metavar='FILE',
+                        help='JSON file remembering the detected encoding '
+                             'of input files between runs')
+    parser.add_argument('--cache-dir', default=default_directory(),
+                        help='directory of the parsed track cache, with '
+                             '--cache (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                        help='size limit of the parsed track cache '
+                             '(default: %(default)s)')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep parsed inputs in the parsed track cache '
+                             'and read them back from it on later runs')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='empty the parsed track cache first')
+    parser.add_argument('--window', metavar='START-END',
+                        help='only merge what is shown from START to END, '
+                             'in ms or HH:MM:SS,mmm, e.g. '
+                             '00:10:00,000-00:12:00,000')
+    parser.add_argument('--offset', nargs=2, action='append', default=[],
+                        metavar=('N', 'MS'),
+                        help='shift input N (1-based) by MS ms, or by '
+                             'HH:MM:SS,mmm; negative shifts (in ms, e.g. '
+                             '-1500) are earlier')
+    parser.add_argument('--scale', nargs=2, action='append', default=[],
+                        metavar=('N', 'FACTOR'),
+                        help='multiply the times of input N by FACTOR')
+    parser.add_argument('--fps', nargs=3, action='append', default=[],
+                        metavar=('N', 'FROM', 'TO'),
+                        help='retime input N, made for a FROM fps video, '
+                             'for a TO fps one, e.g. --fps 2 23.976 25')
+    parser.add_argument('--sync', nargs=5, action='append', default=[],
+                        metavar=('N', 'A', 'A2', 'B', 'B2'),
+                        help='retime input N so that A is shown at A2 and '
+                             'B at B2 (ms or HH:MM:SS,mmm). Transforms of an '
+                             'input apply in the order --fps, --scale, '
+                             '--sync, --offset')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='write per-stage timings and counters as JSON '
+                             'to FILE (default: stderr)')
+    args = parser.parse_args()
+
+    track_cache = TrackCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.clear_cache:
+        track_cache.clear()
+    if not args.cache:
+        track_cache = None
+
+    encoding = args.encoding
+    if args.output is not None:
+        inputs = args.subtitles
+        output = args.output
+    elif len(args.subtitles) in (3, 4):
+        inputs = args.subtitles[0:2]
+        output = args.subtitles[2]
+        if len(args.subtitles) == 4:
+            encoding = args.subtitles[3]
+    else:
+        parser.print_usage()
         sys.exit(1)
+    if len(inputs) < 2:
+        parser.error('at least two subtitles are needed to merge')
+
+    order = None
+    if args.order is not None:
+        try:
+            order = [int(n) - 1 for n in args.order.split(',')]
+        except ValueError:
+            parser.error('--order takes comma separated numbers')
+        if sorted(order) != list(range(len(inputs))):
+            parser.error('--order must list every input exactly once')
+
+    window = None
+    if args.window is not None:
+        try:
+            window = [int(t) if ':' not in t else timestamp_to_ms(t.strip())
+                      for t in args.window.split('-')]
+        except ValueError:
+            window = None
+        if window is None or len(window) != 2 or window[0] >= window[1]:
+            parser.error('--window takes START-END with START before END')
+
+    transforms = [None] * len(inputs)
+    for option, values in (
+            [('--fps', v) for v in args.fps] +
+            [('--scale', v) for v in args.scale] +
+            [('--sync', v) for v in args.sync] +
+            [('--offset', v) for v in args.offset]):
+        try:
+            n = int(values[0]) - 1
+            if not 0 <= n < len(inputs):
+                raise IndexError(values[0])
+            if option == '--fps':
+                transform = TimeTransform.fps(float(values[1]),
+                                              float(values[2]))
+            elif option == '--scale':
+                transform = TimeTransform(float(values[1]))
+            elif option == '--sync':
+                times = [parse_time(value) for value in values[1:]]
+                transform = TimeTransform.anchors(times[0:2], times[2:4])
+            else:
+                transform = TimeTransform(offset=parse_time(values[1]))
+        except IndexError:
+            parser.error('%s: there is no input %s' % (option, values[0]))
+        except (ValueError, ZeroDivisionError) as e:
+            parser.error('%s %s: %s' % (option, ' '.join(values), e))
+        if transforms[n] is not None:
+            transform = transforms[n].then(transform)
+        transforms[n] = transform
+
+    m = Merger(output_file=output,
+               output_encoding=encoding if encoding else 'utf-8',
+               legacy_merge=args.legacy_merge,
+               encoding_cache=args.encoding_cache,
+               track_cache=track_cache,
+               profile=args.profile is not None,
+               output_format=args.format)
+    if window is not None:
+        m.merge_window(inputs, window[0], window[1], order, transforms)
     else:
-        if len(sys.argv) == 5:
-            encoding = sys.argv[4]
+        m.add_tracks(inputs, order, transforms)
+    broken_pipe = False
+    try:
+        m._write()
+    except BrokenPipeError:
+        # whatever reads stdout went away (| head): the rest of the output
+        # goes nowhere, quietly, and the profile is still written
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        broken_pipe = True
+    if args.profile is not None:
+        import json
+        report = json.dumps(m.profile_report(), indent=2)
+        if args.profile == '-':
+            print(report, file=sys.stderr)
         else:
-            encoding = "utf-8"
-    m = Merger(output_file=sys.argv[3], output_encoding=encoding)
-    m.add(sys.argv[1], sys.argv[2])
-    m._write()
+            with open(args.profile, 'w') as profile:
+                profile.write(report + '\n')
+    if broken_pipe:
+        sys.exit(1)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming WebVTT and ASS/SSA readers.
+
+They read their source line by line through srt_reader.iter_lines, like
+the SRT reader, and yield (start, end, text) rows, MySubtitle cues, or a
+whole CueTable. Cue texts come out as SRT text: lines separated by '\\n',
+with <i>, <b> and <u> tags; other markup (WebVTT classes, voices and
+timestamps, ASS override codes) is dropped and entities are decoded.
+
+track_format tells the format of a subtitle file from its extension, or
+from the beginning of its content when the extension is unknown.
+"""
+import re
+
+from my_subtitle import MySubtitle
+from cue_table import CueTable
+from srt_reader import CHUNK_SIZE, iter_lines, read_srt
+from timecodes import HRS_MS, MINS_MS, SECS_MS
+
+VTT_TIME_RE = re.compile(r'^(?:(\d+):)?(\d\d):(\d\d)\.(\d\d\d)$')
+VTT_TAG_RE = re.compile(r'<(/?)([a-zA-Z]+)?[^<>]*>')
+ASS_TIME_RE = re.compile(r'^(\d+):(\d\d):(\d\d)[.:](\d\d)$')
+ASS_OVERRIDE_RE = re.compile(r'\{([^{}]*)\}')
+ASS_STYLE_RE = re.compile(r'\\([ibu])([01])(?![0-9])')
+# fields of an ASS Dialogue line, when the file has no Format line
+ASS_FORMAT = ['layer', 'start', 'end', 'style', 'name', 'marginl',
+              'marginr', 'marginv', 'effect', 'text']
+
+# format of the file extensions, and what invalid timecodes are reported as
+EXTENSIONS = {'.srt': 'srt', '.smi': 'smi', '.vtt': 'vtt', '.ass': 'ass',
+              '.ssa': 'ass'}
+DESCRIPTIONS = {'srt': 'an SRT', 'vtt': 'a WebVTT', 'ass': 'an ASS/SSA'}
+# bytes read to sniff the format of a file
+SNIFF_SIZE = 4096
+
+
+def _vtt_ms(timestamp):
+    m = VTT_TIME_RE.match(timestamp)
+    if m is None:
+        raise ValueError('invalid timecode %r' % timestamp)
+    hours, minutes, seconds, ms = m.groups()
+    return (int(hours or 0) * HRS_MS + int(minutes) * MINS_MS +
+            int(seconds) * SECS_MS + int(ms))
+
+
+def _vtt_markup(m):
+    name = (m.group(2) or '').lower()
+    if name in ('i', 'b', 'u'):
+        return '<%s%s>' % (m.group(1), name)
+    return ''
+
+
+def vtt_text(lines):
+    ''' SRT text of the lines of a WebVTT cue '''
+    text = VTT_TAG_RE.sub(_vtt_markup, '\n'.join(lines))
+    if '&' in text:
+        # html.entities is a large table, only loaded for texts needing it
+        from html import unescape
+        text = unescape(text)
+    return text
+
+
+def _vtt_cue(block):
+    # (start, end, text) row of a cue block, None for other blocks
+    for i, line in enumerate(block[:2]):
+        if '-->' in line:
+            break
+    else:
+        return None
+    start, _, end = line.partition('-->')
+    # cue settings follow the end time
+    end = end.split()
+    if not end:
+        raise ValueError('invalid timing line %r' % line)
+    try:
+        row = _vtt_ms(start.strip()), _vtt_ms(end[0])
+    except ValueError as e:
+        raise ValueError('%s in cue %s' % (e, block[0].strip()))
+    text = vtt_text(block[i+1:]).strip('\n')
+    if text == '':
+        return None
+    return row + (text,)
+
+
+def iter_vtt_rows(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield a (start, end, text) row for every cue of a WebVTT source.
+
+    The header, NOTE, STYLE and REGION blocks and cues without text are
+    skipped. A timestamp that is not [HH:]MM:SS.mmm raises ValueError.
+    '''
+    block = []
+    for line in iter_lines(source, encoding, chunk_size):
+        if line.strip() != '':
+            block.append(line)
+            continue
+        # the WEBVTT header and the NOTE, STYLE and REGION blocks have no
+        # timing line
+        row = _vtt_cue(block) if block else None
+        if row is not None:
+            yield row
+        block = []
+    if block:
+        row = _vtt_cue(block)
+        if row is not None:
+            yield row
+
+
+def _ass_ms(timestamp):
+    m = ASS_TIME_RE.match(timestamp.strip())
+    if m is None:
+        raise ValueError('invalid timecode %r' % timestamp)
+    hours, minutes, seconds, cs = m.groups()
+    return (int(hours) * HRS_MS + int(minutes) * MINS_MS +
+            int(seconds) * SECS_MS + int(cs) * 10)
+
+
+def _ass_override(m):
+    # <i>, <b>, <u> tags of the \i, \b and \u codes of an override block
+    return ''.join('<%s%s>' % ('' if on == '1' else '/', name)
+                   for name, on in ASS_STYLE_RE.findall(m.group(1)))
+
+
+def ass_text(text):
+    ''' SRT text of the Text field of an ASS Dialogue line '''
+    text = ASS_OVERRIDE_RE.sub(_ass_override, text)
+    return text.replace('\\N', '\n').replace('\\n', '\n').replace(
+        '\\h', u'\u00a0')
+
+
+def iter_ass_rows(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield a (start, end, text) row for every Dialogue line of an ASS or
+    SSA source, in file order.
+
+    Fields are found through the Format line of the [Events] section.
+    Comment lines and dialogues without text are skipped. A timestamp that
+    is not H:MM:SS.cc raises ValueError.
+    '''
+    events = False
+    fields = ASS_FORMAT
+    for number, line in enumerate(iter_lines(source, encoding, chunk_size),
+                                  1):
+        line = line.strip()
+        if line.startswith('['):
+            events = line.lower() == '[events]'
+            continue
+        if not events:
+            continue
+        kind, _, value = line.partition(':')
+        kind = kind.strip().lower()
+        if kind == 'format':
+            fields = [field.strip().lower() for field in value.split(',')]
+            continue
+        if kind != 'dialogue':
+            continue
+        # the text is the last field and may hold commas
+        values = dict(zip(fields, value.split(',', len(fields) - 1)))
+        try:
+            start = _ass_ms(values.get('start', ''))
+            end = _ass_ms(values.get('end', ''))
+        except ValueError as e:
+            raise ValueError('%s on line %d' % (e, number))
+        text = ass_text(values.get('text', '')).strip('\n')
+        if text.strip() != '':
+            yield start, end, text
+
+
+def iter_vtt(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield a MySubtitle for every cue of a WebVTT source '''
+    for start_time, end_time, text in iter_vtt_rows(source, encoding,
+                                                    chunk_size):
+        yield MySubtitle(start_time, end_time, text)
+
+
+def iter_ass(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' yield a MySubtitle for every Dialogue line of an ASS/SSA source '''
+    for start_time, end_time, text in iter_ass_rows(source, encoding,
+                                                    chunk_size):
+        yield MySubtitle(start_time, end_time, text)
+
+
+def read_vtt(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' CueTable of every cue of a WebVTT source '''
+    return CueTable(iter_vtt_rows(source, encoding, chunk_size))
+
+
+def read_ass(source, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    ''' CueTable of every Dialogue line of an ASS/SSA source '''
+    return CueTable(iter_ass_rows(source, encoding, chunk_size))
+
+
+# CueTable reader of every text format
+READERS = {'srt': read_srt, 'vtt': read_vtt, 'ass': read_ass}
+
+
+def sniff_format(head):
+    ''' format of a file from the str its content starts with: vtt, ass
+    or srt '''
+    head = head.lstrip(u'\ufeff \t\r\n')
+    if head.startswith('WEBVTT'):
+        return 'vtt'
+    if head.lower().startswith('[script info]'):
+        return 'ass'
+    return 'srt'
+
+
+def track_format(path, encoding=None, file=None):
+    ''' format of the subtitle file at path: from its extension when it is
+    known, else sniffed from its first bytes decoded with encoding '''
+    for extension, name in EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return name
+    opened = file is None
+    if opened:
+        file = open(path, 'rb')
+    try:
+        head = file.read(SNIFF_SIZE)
+        file.seek(0)
+    finally:
+        if opened:
+            file.close()
+    return sniff_format(head.decode(encoding or 'utf-8', 'ignore'))
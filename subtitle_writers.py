@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming WebVTT, ASS and SAMI writers.
+
+They share SRTWriter's streaming and batching: cues are formatted a batch
+at a time straight from the columns of a CueTable and encoded as they go,
+so a merged track is written in any format without going through an SRT
+file first. Cue texts are taken as SRT text (lines, and <i>, <b>, <u> and
+<font color> tags) and translated into the markup of each format.
+
+ASSWriter can also write every source track of a merge as its own style,
+the first one at the top of the screen and the others stacked up from the
+bottom, instead of the merged cues whose texts are joined line by line.
+"""
+import re
+
+from srt_writer import SRTWriter
+from timecodes import HRS_MS, MINS_MS, SECS_MS
+
+# SRT text markup, plus what each format has to escape
+VTT_TEXT_RE = re.compile(r'<(/?)([a-zA-Z]+)[^<>]*>|[<>]|&(?!#?\w+;)|'
+                         r'-->|\n\n+')
+SAMI_TEXT_RE = re.compile(r'<(/?)(i|b|u|font|br)\b[^<>]*>|[<>]|'
+                          r'&(?!#?\w+;)|\n', re.IGNORECASE)
+ASS_TEXT_RE = re.compile(r'<(/?)([a-zA-Z]+)([^<>]*)>|\n')
+FONT_COLOR_RE = re.compile(r'color\s*=\s*["\']?#?([0-9a-fA-F]{6})\b',
+                           re.IGNORECASE)
+ESCAPES = {'<': '&lt;', '>': '&gt;', '&': '&amp;', '-->': '--&gt;'}
+
+ASS_HEADER = u'''[Script Info]
+ScriptType: v4.00+
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+PlayResX: %d
+PlayResY: %d
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, \
+OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, \
+ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, \
+MarginR, MarginV, Encoding
+%s
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, \
+Text
+'''
+ASS_STYLE = (u'Style: %s,Arial,%d,&H00FFFFFF,&H000000FF,&H00000000,'
+             u'&H80000000,0,0,0,0,100,100,0,0,1,1,0,%d,10,10,%d,1\n')
+# numpad alignments of ASS styles
+TOP, BOTTOM = 8, 2
+# vertical margin of the lowest style, and added per track stacked on it
+MARGIN_V = 10
+STACK_MARGIN_V = 40
+
+
+def _vtt_markup(m):
+    if m.group(2) is not None:
+        name = m.group(2).lower()
+        return '<%s%s>' % (m.group(1), name) if name in ('i', 'b', 'u') else ''
+    if m.group(0).startswith('\n'):
+        # a blank line would end the cue
+        return '\n'
+    return ESCAPES[m.group(0)]
+
+
+def vtt_text(text):
+    ''' WebVTT cue text of an SRT cue text '''
+    return VTT_TEXT_RE.sub(_vtt_markup, text)
+
+
+def _sami_markup(m):
+    if m.group(2) is not None:
+        return m.group(0)
+    if m.group(0) == '\n':
+        return '<br>'
+    return ESCAPES[m.group(0)]
+
+
+def sami_text(text):
+    ''' SAMI paragraph of an SRT cue text '''
+    return SAMI_TEXT_RE.sub(_sami_markup, text) or '&nbsp;'
+
+
+def _ass_markup(m):
+    if m.group(0) == '\n':
+        return '\\N'
+    close, name = m.group(1), m.group(2).lower()
+    if name in ('i', 'b', 'u'):
+        return '{\\%s%d}' % (name, 0 if close else 1)
+    if name == 'font':
+        if close:
+            return '{\\c}'
+        color = FONT_COLOR_RE.search(m.group(3))
+        if color is not None:
+            rgb = color.group(1).upper()
+            return '{\\c&H%s%s%s&}' % (rgb[4:6], rgb[2:4], rgb[0:2])
+    return ''
+
+
+def ass_text(text):
+    ''' ASS dialogue text of an SRT cue text '''
+    return ASS_TEXT_RE.sub(_ass_markup, text)
+
+
+def ass_timestamp(time_ms):
+    ''' H:MM:SS.cc timestamp of ASS events '''
+    return '%d:%02d:%02d.%02d' % (time_ms // HRS_MS,
+                                  time_ms // MINS_MS % 60,
+                                  time_ms // SECS_MS % 60,
+                                  time_ms % SECS_MS // 10)
+
+
+class VTTWriter(SRTWriter):
+    '''
+    Write cues to a binary stream in WebVTT format, see SRTWriter.
+    '''
+    def _begin(self):
+        return 'WEBVTT\n\n'
+
+    def _timings(self, starts, ends):
+        return [timing.replace(',', '.')
+                for timing in SRTWriter._timings(self, starts, ends)]
+
+    def _cue(self, parts, start, end, timing, text):
+        SRTWriter._cue(self, parts, start, end, timing, vtt_text(text))
+
+
+class SAMIWriter(SRTWriter):
+    '''
+    Write cues to a binary stream in SAMI format, see SRTWriter.
+
+    Every cue is one SYNC, followed by an empty one where the screen is
+    cleared before the next cue starts; cues must not overlap, as in a
+    merged CueTable.
+
+    smi_class: class of the paragraphs
+    language: lang of that class
+    '''
+    def __init__(self, stream, encoding='utf-8', smi_class='SUBTTL',
+                 language='und'):
+        SRTWriter.__init__(self, stream, encoding)
+        self.smi_class = smi_class
+        self.language = language
+        # end of the last cue written, until the screen is cleared
+        self._showing = None
+
+    def _begin(self):
+        return ('<SAMI>\n<HEAD>\n<STYLE TYPE="text/css">\n<!--\n'
+                'P { margin-left:8pt; margin-right:8pt; margin-bottom:2pt; '
+                'margin-top:2pt; text-align:center; }\n'
+                '.%s { Name:%s; lang:%s; }\n-->\n</STYLE>\n</HEAD>\n<BODY>\n'
+                % (self.smi_class, self.smi_class, self.language))
+
+    def _clear(self, parts, time_ms):
+        parts.append('<SYNC Start=%d><P Class=%s>&nbsp;\n'
+                     % (time_ms, self.smi_class))
+
+    def _timings(self, starts, ends):
+        return starts
+
+    def _cue(self, parts, start, end, timing, text):
+        if self._showing is not None and self._showing < start:
+            self._clear(parts, self._showing)
+        self.count += 1
+        parts.append('<SYNC Start=%d><P Class=%s>%s\n'
+                     % (start, self.smi_class, sami_text(text)))
+        self._showing = end
+
+    def _end(self):
+        parts = []
+        if self._showing is not None:
+            self._clear(parts, self._showing)
+        parts.append('</BODY>\n</SAMI>\n')
+        return ''.join(parts)
+
+
+class ASSWriter(SRTWriter):
+    '''
+    Write cues to a binary stream in ASS format, see SRTWriter.
+
+    tracks: number of styles; with more than one, write_all(cues, track)
+            writes the cues of a source track with its own style, Track1
+            at the top of the screen and the next ones stacked up from the
+            bottom, Track2 highest
+    play_res: (width, height) of the script, font size and margins are
+              relative to it
+    '''
+    def __init__(self, stream, encoding='utf-8', tracks=1,
+                 play_res=(384, 288)):
+        SRTWriter.__init__(self, stream, encoding)
+        self.play_res = play_res
+        if tracks == 1:
+            self.styles = ['Default']
+        else:
+            self.styles = ['Track%d' % (i + 1) for i in range(tracks)]
+        self._style = self.styles[0]
+
+    def _begin(self):
+        font_size = self.play_res[1] // 18
+        styles = []
+        for i, name in enumerate(self.styles):
+            if i == 0 and len(self.styles) > 1:
+                styles.append(ASS_STYLE % (name, font_size, TOP, MARGIN_V))
+            else:
+                level = len(self.styles) - 1 - i
+                styles.append(ASS_STYLE % (name, font_size, BOTTOM,
+                                           MARGIN_V + level * STACK_MARGIN_V))
+        return ASS_HEADER % (self.play_res[0], self.play_res[1],
+                             ''.join(styles))
+
+    def _timings(self, starts, ends):
+        return [ass_timestamp(start) + ',' + ass_timestamp(end)
+                for start, end in zip(starts, ends)]
+
+    def _cue(self, parts, start, end, timing, text):
+        if end <= start:
+            return
+        self.count += 1
+        parts.append('Dialogue: 0,%s,%s,,0,0,0,,%s\n'
+                     % (timing, self._style, ass_text(text)))
+
+    def write_all(self, cues, track=0):
+        ''' write cues with the style of track '''
+        self._style = self.styles[track]
+        SRTWriter.write_all(self, cues)
+
+
+# writer of every output format, and the format of output file extensions
+WRITERS = {'srt': SRTWriter, 'vtt': VTTWriter, 'ass': ASSWriter,
+           'smi': SAMIWriter}
+EXTENSIONS = {'.vtt': 'vtt', '.ass': 'ass', '.smi': 'smi', '.sami': 'smi'}
+
+
+def format_for(path):
+    ''' output format of a file name, SRT unless the extension says
+    otherwise '''
+    path = path if isinstance(path, str) else ''
+    for extension, name in EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return name
+    return 'srt'
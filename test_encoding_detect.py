@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of encoding detection on files whose sample is plain ASCII.
+"""
+import io
+
+from encoding_detect import SAMPLE_SIZE, EncodingCache, detect_file
+
+
+def ascii_lines(size):
+    return b''.join(b'%d plain ascii text\n' % i
+                    for i in range(size // 20))
+
+
+def test_ascii_file_is_utf8():
+    data = ascii_lines(4 * SAMPLE_SIZE)
+    assert detect_file(io.BytesIO(data))['encoding'] == 'UTF-8'
+
+
+def test_non_ascii_byte_outside_the_sample(tmp_path):
+    # a single Latin-1 byte the sample does not reach decides the encoding
+    head = ascii_lines(SAMPLE_SIZE // 2 + 8000)
+    data = head + u'caf\xe9 au lait\n'.encode('latin-1') + \
+        ascii_lines(2 * SAMPLE_SIZE)
+    path = tmp_path / 'late.srt'
+    path.write_bytes(data)
+    cache = str(tmp_path / 'encodings.json')
+    for _ in range(2):
+        encoding = EncodingCache(cache).detect(str(path))['encoding']
+        data.decode(encoding)
+        assert encoding.lower().replace('-', '') != 'utf8'
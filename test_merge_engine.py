@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Randomized check of the sweep-line merge engine against the per-cue
+insertion it replaced (Merger._check_times, kept behind legacy_merge).
+"""
+import random
+
+from cue_table import CueTable
+from merge_engine import sweep_merge
+from my_subtitle import MySubtitle
+from sub_merger import Merger
+
+
+def random_tracks(rnd, tracks=3, cues=12, span=60):
+    ''' lists of MySubtitle with crowded, often overlapping times, some
+    of them empty or sharing bounds '''
+    result = []
+    for k in range(rnd.randint(1, tracks)):
+        track = []
+        for i in range(rnd.randint(0, cues)):
+            start = rnd.randint(0, span)
+            track.append(MySubtitle(start, start + rnd.randint(0, span // 2),
+                                    '%d.%d' % (k, i)))
+        result.append(track)
+    return result
+
+
+def legacy_merge(tracks):
+    merger = Merger(legacy_merge=True)
+    for track in tracks:
+        for i, cue in enumerate(track):
+            # the legacy insertion never handled empty cues
+            if cue.end() > cue.start():
+                merger._check_times(cue, i + 1)
+    return [(cue.start(), cue.end(), cue.data()) for cue in merger.subtitles]
+
+
+def test_sweep_matches_legacy():
+    for seed in range(2000):
+        tracks = random_tracks(random.Random(seed))
+        assert list(sweep_merge(tracks).rows()) == legacy_merge(tracks), seed
+
+
+def test_sweep_order_and_tables():
+    # a CueTable track and order give the merge of the reordered tracks
+    for seed in range(300):
+        rnd = random.Random(seed)
+        tracks = random_tracks(rnd)
+        order = list(range(len(tracks)))
+        rnd.shuffle(order)
+        tables = [CueTable((cue.start(), cue.end(), cue.data())
+                           for cue in track) for track in tracks]
+        expected = list(sweep_merge([tracks[i] for i in order]).rows())
+        assert list(sweep_merge(tables, order).rows()) == expected, seed
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+MergeServer on an ephemeral port, spoken to over plain HTTP.
+"""
+import asyncio
+import base64
+import io
+import json
+
+from cue_table import CueTable
+from merge_server import MergeServer
+from srt_writer import SRTWriter
+
+
+def srt(count, text):
+    output = io.BytesIO()
+    with SRTWriter(output) as writer:
+        writer.write_all(CueTable([(i * 1000, i * 1000 + 1500,
+                                    u'%s %d' % (text, i))
+                                   for i in range(count)]))
+    return output.getvalue()
+
+
+def merge_body(subtitles):
+    return json.dumps({'subtitles': [
+        {'name': name, 'data': base64.b64encode(data).decode('ascii')}
+        for name, data in subtitles]}).encode('utf-8')
+
+
+async def request(port, method, path, body=b''):
+    ''' (status, headers, body) of one request '''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(('%s %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n'
+                  % (method, path, len(body))).encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, body
+
+
+async def exercise(server):
+    (_, port), = await server.start(port=0)
+    small = [('top.srt', srt(3, 'top')), ('bottom.srt', srt(3, 'bottom'))]
+    status, headers, body = await request(port, 'POST', '/merge',
+                                          merge_body(small))
+    assert status == 200
+    assert headers['X-Cues'] == '5'
+    assert b'top 0\nbottom 0' in body
+
+    for name in ('', '.', '..', 'a/..', '..#ENCC'):
+        status, _, body = await request(
+            port, 'POST', '/merge', merge_body([(name, small[0][1]),
+                                                small[1]]))
+        assert status == 400, name
+        assert b'invalid subtitle name' in body
+
+    # with one worker and no queue, a merge arriving while another runs
+    # is turned away
+    large = merge_body([('top.srt', srt(40000, 'top')),
+                        ('bottom.srt', srt(40000, 'bottom'))])
+    running = asyncio.ensure_future(request(port, 'POST', '/merge', large))
+    while server.active == 0:
+        await asyncio.sleep(0.01)
+    status, _, _ = await request(port, 'POST', '/merge', merge_body(small))
+    assert status == 503
+    assert (await running)[0] == 200
+
+    status, _, body = await request(port, 'GET', '/metrics')
+    assert status == 200
+    metrics = json.loads(body.decode('utf-8'))
+    assert metrics['completed'] == 2
+    assert metrics['rejected'] == 1
+    assert metrics['active'] == metrics['queued'] == 0
+
+
+def test_merge_server():
+    async def main():
+        server = MergeServer(workers=1, max_queue=0)
+        try:
+            await exercise(server)
+        finally:
+            await server.close()
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Randomized check of MergeSession.update against a full sweep_merge of the
+new bottom track.
+"""
+import random
+
+from cue_table import CueTable
+from merge_engine import sweep_merge
+from merge_session import MergeSession
+
+
+def random_rows(rnd, count):
+    ''' (start, end, text) rows mostly in time order, with empty and
+    repeated cues; sometimes shuffled '''
+    rows = []
+    time = 0
+    for i in range(count):
+        time += rnd.randint(0, 3000)
+        rows.append((time, time + rnd.randint(-100, 5000),
+                     'c%d' % rnd.randint(0, 50)))
+    if rnd.random() < 0.3:
+        rnd.shuffle(rows)
+    return rows
+
+
+def edit(rnd, rows):
+    ''' rows with a few cues removed, inserted or retimed '''
+    rows = list(rows)
+    for _ in range(rnd.randint(0, 4)):
+        op = rnd.random()
+        if op < 0.3 and rows:
+            del rows[rnd.randrange(len(rows))]
+        elif op < 0.6:
+            time = rnd.randint(0, 60000)
+            rows.insert(rnd.randint(0, len(rows)),
+                        (time, time + rnd.randint(-10, 4000),
+                         'n%d' % rnd.randint(0, 9)))
+        elif rows:
+            i = rnd.randrange(len(rows))
+            start, end, text = rows[i]
+            rows[i] = (start + rnd.randint(-500, 500),
+                       end + rnd.randint(-500, 500), text + 'x')
+    return rows
+
+
+def test_update_matches_full_merge():
+    for seed in range(500):
+        rnd = random.Random(seed)
+        top = CueTable(random_rows(rnd, rnd.randint(0, 40)))
+        bottom = random_rows(rnd, rnd.randint(0, 40))
+        session = MergeSession(top, CueTable(bottom))
+        for step in range(5):
+            bottom = edit(rnd, bottom)
+            session.update(CueTable(bottom))
+            full = sweep_merge([top, CueTable(bottom)])
+            assert list(session.subtitles.rows()) == list(full.rows()), \
+                (seed, step)
+
+
+def test_unchanged_update_replaces_nothing():
+    rnd = random.Random(0)
+    top = CueTable(random_rows(rnd, 200))
+    bottom = random_rows(rnd, 200)
+    session = MergeSession(top, CueTable(bottom))
+    assert session.update(CueTable(bottom)) == {'changed': 0, 'windows': 0,
+                                                'replaced': 0}
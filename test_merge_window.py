@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Randomized check of Merger.merge_window against a full merge of the same
+files clipped to the window.
+"""
+import io
+import random
+
+import pytest
+
+from cue_table import CueTable
+from srt_writer import SRTWriter
+from sub_merger import Merger
+from time_transform import TimeTransform
+
+
+def write_srt(path, rnd, count):
+    ''' SRT file of count random cues, overlapping and not always in time
+    order '''
+    rows = []
+    for i in range(count):
+        start = rnd.randint(0, 600000)
+        rows.append((start, start + rnd.randint(1, 8000),
+                     u'cue %d\nline é' % i))
+    rows.sort(key=lambda row: row[0] + rnd.randint(-3000, 3000))
+    with io.open(path, 'wb') as file:
+        with SRTWriter(file) as writer:
+            writer.write_all(CueTable(rows))
+
+
+def write_smi(path, rnd, count):
+    ''' SMI file of count SYNCs with a KRCC and an ENCC paragraph each,
+    some of them blank '''
+    lines = ['<SAMI>', '<HEAD>', '<STYLE TYPE="text/css">', '<!--',
+             '.KRCC { Name:Korean; lang:ko-KR; }',
+             '.ENCC { Name:English; lang:en-US; }', '-->', '</STYLE>',
+             '</HEAD>', '<BODY>']
+    time = 1000
+    for i in range(count):
+        lines.append('<SYNC Start=%d>' % time)
+        for name in ('KRCC', 'ENCC'):
+            if rnd.random() < 0.3:
+                lines.append('<P Class=%s>&nbsp;' % name)
+            else:
+                lines.append(u'<P Class=%s><font color="#ff0000">대사 '
+                             u'%d %s</font><br><b>b</b>' % (name, i, name))
+        time += rnd.randint(300, 4000)
+    lines += ['<SYNC Start=%d><P Class=KRCC>&nbsp;' % time, '</BODY>',
+              '</SAMI>']
+    with io.open(path, 'w', encoding='utf-8', newline='\r\n') as file:
+        file.write(u'\n'.join(lines) + u'\n')
+
+
+def clipped(table, start_ms, end_ms):
+    return [(max(start, start_ms), min(end, end_ms), text)
+            for start, end, text in table.rows()
+            if min(end, end_ms) > max(start, start_ms)]
+
+
+def check_windows(rnd, addresses, transforms=None, windows=40):
+    full = Merger('out.srt')
+    full.add_tracks(addresses, transforms=transforms)
+    last = max(full.subtitles.ends) if len(full.subtitles) else 1000
+    for _ in range(windows):
+        start = rnd.randint(0, last)
+        end = start + rnd.randint(1, 200000)
+        window = Merger('out.srt').merge_window(addresses, start, end,
+                                                transforms=transforms)
+        assert list(window.rows()) == clipped(full.subtitles, start, end), \
+            (addresses, transforms, start, end)
+
+
+def test_window_matches_clipped_merge(tmp_path):
+    rnd = random.Random(0)
+    top, bottom = str(tmp_path / 'top.srt'), str(tmp_path / 'bottom.srt')
+    smi = str(tmp_path / 'both.smi')
+    write_srt(top, rnd, 300)
+    write_srt(bottom, rnd, 300)
+    write_smi(smi, rnd, 200)
+    for addresses in ([top, bottom], [top, smi],
+                      [smi + '#KRCC', smi + '#ENCC']):
+        check_windows(rnd, addresses)
+
+
+def test_transformed_window_matches_clipped_merge(tmp_path):
+    rnd = random.Random(1)
+    top, bottom = str(tmp_path / 'top.srt'), str(tmp_path / 'bottom.srt')
+    write_srt(top, rnd, 300)
+    write_srt(bottom, rnd, 300)
+    for transforms in ([TimeTransform(offset=-45000), None],
+                       [TimeTransform.fps(23.976, 25),
+                        TimeTransform(2.5, 1234)],
+                       [None, TimeTransform(0.3, -700)]):
+        check_windows(rnd, [top, bottom], transforms)
+
+
+def test_window_of_unknown_class(tmp_path, capsys):
+    smi = str(tmp_path / 'both.smi')
+    write_smi(smi, random.Random(2), 20)
+    with pytest.raises(SystemExit) as error:
+        Merger('out.srt').merge_window([smi + '#KRCC', smi + '#JPCC'],
+                                       0, 60000)
+    assert error.value.code == 1
+    assert 'has no JPCC class. Classes found: KRCC, ENCC' in \
+        capsys.readouterr().out
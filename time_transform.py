@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Linear retiming of subtitle tracks.
+
+A TimeTransform maps every time t of a track to round(t * scale + offset)
+ms, which covers shifting a track (offset), stretching it (scale), frame
+rate conversion (scale of source fps / target fps) and syncing it on two
+points of the video (two anchors fix both). Transforms are applied to the
+start and end columns of a CueTable at once, vectorized with NumPy for
+long tracks; times falling before 0 are clamped to 0, so cues shifted out
+of the video end up empty and are dropped by the merge.
+"""
+import math
+from array import array
+
+from timecodes import _numpy_for, timestamp_to_ms
+
+
+def parse_time(text):
+    ''' ms of "1500", "-1500" or "[-]HH:MM:SS,mmm" '''
+    text = text.strip()
+    sign = -1 if text.startswith('-') else 1
+    if ':' in text:
+        return sign * timestamp_to_ms(text.lstrip('+-'))
+    return int(text)
+
+
+class TimeTransform(object):
+    '''
+    t -> round(t * scale + offset), in ms.
+
+    TimeTransform(offset=-1500)                  1.5 s earlier
+    TimeTransform.fps(23.976, 25)                23.976 fps timing on a
+                                                 25 fps video
+    TimeTransform.anchors((a, a2), (b, b2))      a shown at a2, b at b2
+    '''
+    def __init__(self, scale=1.0, offset=0):
+        if scale <= 0:
+            raise ValueError('scale must be positive, got %r' % scale)
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def fps(cls, source_fps, target_fps):
+        ''' timing made for a source_fps video, shown on a target_fps one '''
+        return cls(float(source_fps) / float(target_fps))
+
+    @classmethod
+    def anchors(cls, first, second):
+        ''' transform moving the time first[0] to first[1] and second[0] to
+        second[1] '''
+        (a, a2), (b, b2) = first, second
+        if a == b:
+            raise ValueError('sync anchors need two different times')
+        scale = float(b2 - a2) / (b - a)
+        return cls(scale, a2 - a * scale)
+
+    def then(self, other):
+        ''' transform applying self, then other '''
+        return TimeTransform(self.scale * other.scale,
+                             self.offset * other.scale + other.offset)
+
+    def is_identity(self):
+        return self.scale == 1 and self.offset == 0
+
+    def __call__(self, time_ms):
+        return max(0, int(math.floor(time_ms * self.scale + self.offset +
+                                     0.5)))
+
+    def inverse(self, time_ms):
+        ''' the (fractional) time mapped to time_ms '''
+        return (time_ms - self.offset) / self.scale
+
+    def times(self, column):
+        ''' array('q') of a column of ms values, transformed '''
+        numpy = _numpy_for(len(column))
+        if numpy is not None:
+            values = numpy.asarray(column, dtype=numpy.float64)
+            values = numpy.floor(values * self.scale + self.offset + 0.5)
+            return array('q', numpy.maximum(values, 0).astype(
+                numpy.int64).tolist())
+        if self.scale == 1 and self.offset == int(self.offset):
+            offset = int(self.offset)
+            return array('q', [max(0, t + offset) for t in column])
+        return array('q', [self(t) for t in column])
+
+    def apply(self, table):
+        ''' CueTable of the cues of table with their times transformed '''
+        if self.is_identity():
+            return table
+        return table.with_times(self.times(table.starts),
+                                self.times(table.ends))
+
+    def __repr__(self):
+        return '<TimeTransform t * %r + %r>' % (self.scale, self.offset)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+SRT timestamp codec.
+
+Single timestamps are converted with timestamp_to_ms/ms_to_timestamp. Whole
+tracks are converted in bulk: parse_timings runs one compiled regex over
+every timing line of a track at once, and format_timings renders a whole
+column of start/end times with a single %-format call. When NumPy is
+installed the arithmetic on long columns is vectorized as well; it is
+imported the first time such a column shows up, as importing it costs more
+than it saves on a short track.
+"""
+import re
+from array import array
+
+# shortest column worth NumPy
+NUMPY_MIN = 10000
+# None until NumPy was looked for, False when it is not installed
+_numpy = None
+
+HRS_MS = 3600000
+MINS_MS = 60000
+SECS_MS = 1000
+
+TIMESTAMP_FORMAT = '%02d:%02d:%02d,%03d'
+TIMING_FORMAT = TIMESTAMP_FORMAT + ' --> ' + TIMESTAMP_FORMAT
+
+# one "HH:MM:SS,mmm --> HH:MM:SS,mmm" line, surrounding blanks allowed
+TIMING_RE = re.compile(r'^[ \t]*(\d\d):(\d\d):(\d\d),(\d\d\d)[ \t]*-->'
+                       r'[ \t]*(\d\d):(\d\d):(\d\d),(\d\d\d)[ \t]*$',
+                       re.MULTILINE)
+
+
+def timestamp_to_ms(timestr):
+    ''' convert a HH:MM:SS,mmm timestamp into milliseconds '''
+    if len(timestr) != 12:
+        raise ValueError('invalid timecode %r' % timestr)
+    return (int(timestr[0:2]) * HRS_MS +
+            int(timestr[3:5]) * MINS_MS +
+            int(timestr[6:8]) * SECS_MS +
+            int(timestr[9:12]))
+
+
+def ms_to_timestamp(time_ms):
+    ''' convert milliseconds into a HH:MM:SS,mmm timestamp '''
+    return TIMESTAMP_FORMAT % (time_ms // HRS_MS,
+                               time_ms // MINS_MS % 60,
+                               time_ms // SECS_MS % 60,
+                               time_ms % SECS_MS)
+
+
+def _numpy_for(length):
+    # the numpy module for a column of length values, or None
+    global _numpy
+    if length < NUMPY_MIN:
+        return None
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def parse_timings(text):
+    ''' (starts, ends) array('q') columns of every timing line in text.
+
+    text holds one timing line per line; lines that are not timing lines
+    are ignored, so callers can compare the number of parsed timings with
+    the number of lines they passed.
+    '''
+    fields = TIMING_RE.findall(text)
+    if not fields:
+        return array('q'), array('q')
+    numpy = _numpy_for(len(fields))
+    if numpy is not None:
+        values = numpy.array(fields, dtype=numpy.int64)
+        scale = numpy.array([HRS_MS, MINS_MS, SECS_MS, 1], dtype=numpy.int64)
+        starts = values[:, 0:4].dot(scale)
+        ends = values[:, 4:8].dot(scale)
+        return array('q', starts.tolist()), array('q', ends.tolist())
+    starts = array('q', [int(f[0]) * HRS_MS + int(f[1]) * MINS_MS +
+                         int(f[2]) * SECS_MS + int(f[3]) for f in fields])
+    ends = array('q', [int(f[4]) * HRS_MS + int(f[5]) * MINS_MS +
+                       int(f[6]) * SECS_MS + int(f[7]) for f in fields])
+    return starts, ends
+
+
+def _fields(times_ms):
+    # (hours, minutes, seconds, ms) columns of a column of ms values
+    numpy = _numpy_for(len(times_ms))
+    if numpy is not None:
+        times = numpy.asarray(times_ms, dtype=numpy.int64)
+        return ((times // HRS_MS).tolist(),
+                (times // MINS_MS % 60).tolist(),
+                (times // SECS_MS % 60).tolist(),
+                (times % SECS_MS).tolist())
+    return ([t // HRS_MS for t in times_ms],
+            [t // MINS_MS % 60 for t in times_ms],
+            [t // SECS_MS % 60 for t in times_ms],
+            [t % SECS_MS for t in times_ms])
+
+
+def format_timestamps(times_ms):
+    ''' list of HH:MM:SS,mmm timestamps of a column of ms values '''
+    if len(times_ms) == 0:
+        return []
+    flat = [value for row in zip(*_fields(times_ms)) for value in row]
+    text = ((TIMESTAMP_FORMAT + '\n') * len(times_ms)) % tuple(flat)
+    return text.split('\n')[:-1]
+
+
+def format_timings(starts, ends):
+    ''' list of "HH:MM:SS,mmm --> HH:MM:SS,mmm" lines of two ms columns '''
+    if len(starts) == 0:
+        return []
+    flat = [value for row in zip(*(_fields(starts) + _fields(ends)))
+            for value in row]
+    text = ((TIMING_FORMAT + '\n') * len(starts)) % tuple(flat)
+    return text.split('\n')[:-1]
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of parsed subtitle tracks.
+
+Parsed CueTables are stored in a compact binary file per source, named
+after the content hash of the source, what was parsed out of it (a SRT
+track, a flattened SMI track or every class of a SMI file) and
+PARSER_VERSION. A hit reads the columns straight back into CueTables, so
+encoding detection, decoding, parsing and cleaning are all skipped.
+
+Entries are touched when they are used and the least recently used ones
+are removed once the cache grows over its size limit.
+
+File layout (little-endian):
+    MAGIC, FORMAT_VERSION (H), number of tables (I)
+    per table: has name (B), name length (I), UTF-8 name,
+               number of cues (Q), text bytes (Q),
+               starts, ends and text lengths as int64 columns, texts
+"""
+from __future__ import print_function
+import io
+import os
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+
+from cue_table import CueTable
+from encoding_detect import file_digest
+
+# bump whenever a parser or the text cleaning changes its output
+PARSER_VERSION = 2
+FORMAT_VERSION = 1
+MAGIC = b'MSTC'
+SUFFIX = '.cues'
+MAX_SIZE = 256 * 1024 * 1024
+
+_HEADER = struct.Struct('<4sHI')
+_NAME = struct.Struct('<BI')
+_COUNTS = struct.Struct('<QQ')
+
+
+def default_directory():
+    ''' $XDG_CACHE_HOME/mergesubtitles, or ~/.cache/mergesubtitles '''
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mergesubtitles')
+
+
+def _column(values):
+    column = array('q', values)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _read_column(data, offset, count):
+    column = array('q')
+    column.frombytes(data[offset:offset + 8 * count])
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column, offset + 8 * count
+
+
+def dumps(tables):
+    ''' bytes of an OrderedDict of name (str or None) to CueTable '''
+    parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, len(tables))]
+    for name, table in tables.items():
+        if not table.is_compact():
+            table = table.copy()
+        encoded = b'' if name is None else name.encode('utf-8')
+        parts.append(_NAME.pack(name is not None, len(encoded)))
+        parts.append(encoded)
+        parts.append(_COUNTS.pack(len(table), len(table.buffer)))
+        parts.append(_column(table.starts))
+        parts.append(_column(table.ends))
+        parts.append(_column(table.text_lengths))
+        parts.append(bytes(table.buffer))
+    return b''.join(parts)
+
+
+def loads(data):
+    ''' OrderedDict of name to CueTable of bytes written by dumps; raises
+    ValueError when they are not '''
+    data = memoryview(data)
+    try:
+        magic, version, count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('not a cue cache file')
+        offset = _HEADER.size
+        tables = OrderedDict()
+        for _ in range(count):
+            has_name, length = _NAME.unpack_from(data, offset)
+            offset += _NAME.size
+            name = bytes(data[offset:offset + length]).decode('utf-8') \
+                if has_name else None
+            offset += length
+            cues, size = _COUNTS.unpack_from(data, offset)
+            offset += _COUNTS.size
+            starts, offset = _read_column(data, offset, cues)
+            ends, offset = _read_column(data, offset, cues)
+            lengths, offset = _read_column(data, offset, cues)
+            buffer = data[offset:offset + size]
+            offset += size
+            if len(lengths) != cues or len(buffer) != size:
+                raise ValueError('truncated cue cache file')
+            tables[name] = CueTable.from_columns(starts, ends, lengths,
+                                                 buffer)
+    except struct.error:
+        raise ValueError('truncated cue cache file')
+    return tables
+
+
+class TrackCache(object):
+    '''
+    Cache of parsed tracks in a directory.
+
+    directory: where the entries are kept, created on first write;
+               default_directory() when None
+    max_size: bytes the entries may take before the least recently used
+              ones are removed
+    '''
+    def __init__(self, directory=None, max_size=MAX_SIZE):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, file, kind):
+        ''' key of an opened binary source file parsed as kind '''
+        return '%s-%s-v%d' % (file_digest(file), kind, PARSER_VERSION)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        ''' the tables stored under key, or None '''
+        path = self._path(key)
+        try:
+            with io.open(path, 'rb') as entry:
+                tables = loads(entry.read())
+            # the mtime of an entry is its last use
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tables
+
+    def put(self, key, tables):
+        ''' store an OrderedDict of name to CueTable under key '''
+        path = self._path(key)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with io.open(temp, 'wb') as entry:
+                entry.write(dumps(tables))
+            os.replace(temp, path)
+        except (IOError, OSError) as e:
+            # stderr, as the merged file may be going to stdout
+            print('Cannot write track cache %s: %s' % (path, e),
+                  file=sys.stderr)
+            return
+        self.evict()
+
+    def cached(self, file, kind, parse):
+        ''' tables of an opened binary source file parsed as kind; parse()
+        is only called on a miss, and its result stored unless None '''
+        key = self.key(file, kind)
+        tables = self.get(key)
+        if tables is None:
+            tables = parse()
+            if tables is not None:
+                self.put(key, tables)
+        return tables
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        ''' bytes taken by the entries '''
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        ''' remove least recently used entries until the cache fits '''
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        ''' remove every entry; other files of the directory are kept '''
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def as_track_cache(cache):
+    ''' TrackCache from a TrackCache, a directory path or None (no cache) '''
+    if cache is None or isinstance(cache, TrackCache):
+        return cache
+    return TrackCache(cache)